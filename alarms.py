@@ -1,6 +1,21 @@
 import csv
 import time
 
+import numpy as np
+
+from polygon_set import PolygonSet
+from spatial_index import UniformGrid
+from tag_registry import TagTable
+
+# Proximity thresholds in metres
+FORKLIFT_OPERATOR_THRESHOLD = 3.0
+CRANE_PROXIMITY_THRESHOLD = 5.0
+
+# How far ahead, in seconds, time-to-collision alarms look
+TIME_TO_COLLISION_HORIZON = 3.0
+# Tags whose last report is older than this many seconds (relative to the newest report) are not extrapolated
+TIME_TO_COLLISION_MAX_AGE = 2.0
+
 def add_timestamp():
     # Get the current time as a Unix timestamp
     current_time_unix = int(time.time())
@@ -10,11 +25,50 @@ def add_timestamp():
         writer = csv.writer(file)
         writer.writerow([current_time_unix])
 
+def _as_table(tags):
+    # The checks read the tags as arrays; a dict in the data.json layout (e.g. from getFullSequenceData) is converted
+    return tags if isinstance(tags, TagTable) else TagTable.from_dict(tags)
+
+class _AlarmInputs:
+    # What the previous incremental alarm evaluation was based on, to work out what has changed since
+    __slots__ = ('sequence_name', 'zones', 'epoch', 'version', 'tags', 'operator_rows', 'operator_ids',
+                 'operator_grid', 'forklift_grid', 'crane_locations', 'kinematics', 'unsettled', 'cranes_unsettled',
+                 'time_to_collision_unsettled')
+
+    def __init__(self, sequence_name, zones, epoch):
+        self.sequence_name = sequence_name
+        self.zones = zones
+        self.epoch = epoch  # Rows are only comparable between tables of the same registry epoch
+        self.version = -1  # Registry version of the previous tags; every row has changed since -1
+        self.tags = None
+        self.operator_rows = None
+        self.operator_ids = None
+        self.operator_grid = UniformGrid(FORKLIFT_OPERATOR_THRESHOLD)
+        self.forklift_grid = UniformGrid(FORKLIFT_OPERATOR_THRESHOLD)
+        self.crane_locations = None
+        self.kinematics = None
+        self.unsettled = set()  # Tags whose checks triggered or reset an alarm last time
+        self.cranes_unsettled = False
+        self.time_to_collision_unsettled = False
+
+
 class AlarmManager:
-    def __init__(self, tag_manager):
+    def __init__(self, tag_manager, clock=time.time, kinematics=None, incremental=False, report=True):
         # Store active alarms to avoid duplicates (keyed by tag_id and alarm_type)
         self.active_alarms = {}
         self.tag_manager = tag_manager
+        # Time source for alert timestamps, e.g. VirtualClock.time for an offline render
+        self.clock = clock
+        # KinematicsTracker fed with the incoming reports, for the current speed and heading of each tag
+        self.kinematics = kinematics
+        # Geofence zones compiled by compile_zones, with the zones they were compiled from
+        self._compiled_zones = (None, PolygonSet([]))
+        # Only re-evaluate the checks that the tags updated since the previous tick can affect
+        self.incremental = incremental
+        self._inputs = None
+        self.transitions = 0  # Number of alarms triggered or reset so far
+        # Print each alarm as it is triggered; off for managers that repeat checks already reported elsewhere
+        self.report = report
 
     def check_proximity(self, tag_a, tag_b, threshold):
         """
@@ -25,21 +79,47 @@ class AlarmManager:
         distance = ((x_a - x_b) ** 2 + (y_a - y_b) ** 2) ** 0.5  # Hypotenuse (X, Y distance)
         return distance < threshold
 
+    def get_speed(self, tag_id):
+        """
+        Returns the current speed of a tag in km/h, or None if there is no kinematics tracker
+        or the tag has not been seen yet.
+        """
+        if self.kinematics is None:
+            return None
+        return self.kinematics.speed_kmph(tag_id)
+
+    def compile_zones(self, geofence_zones):
+        """
+        Returns the geofence zones as a PolygonSet. The zones are only recompiled when they
+        change, so passing the same zones on every tick costs a comparison, not a compilation.
+        A PolygonSet (e.g. a Sequence's geofence.polygons) is returned as is.
+        """
+        if isinstance(geofence_zones, PolygonSet):
+            return geofence_zones
+        key = tuple(tuple(tuple(point) for point in zone) for zone in geofence_zones)
+        if key != self._compiled_zones[0]:
+            self._compiled_zones = (key, PolygonSet(key))
+        return self._compiled_zones[1]
+
     def check_geofence(self, tag, geofence_zones):
         """
         Check if the tag is inside any geofence zones.
         """
         x, y, _ = tag['location']
-        for zone in geofence_zones:
-            if self.is_within_zone(x, y, zone):
-                return True
-        return False
+        return self.compile_zones(geofence_zones).contains_point(x, y)
 
-    def check_crane_zone(self, tag, cranes):
+    def check_crane_zone(self, tag, cranes, crane_grid=None):
         """
         Check if the tag is within any crane's circular zone.
+        If a grid of the cranes (keyed by index, see index_cranes) is given, only nearby cranes are checked.
         """
         x, y, _ = tag['location']
+        return self._in_crane_zone(x, y, cranes, crane_grid)
+
+    def _in_crane_zone(self, x, y, cranes, crane_grid=None):
+        # check_crane_zone for a position
+        if crane_grid is not None:
+            cranes = [cranes[i] for i in crane_grid.query(x, y, crane_grid.max_radius)]
         for crane in cranes:  # Iterate over list of cranes
             crane_x, crane_y, crane_z = crane['location']
             distance = ((x - crane_x) ** 2 + (y - crane_y) ** 2) ** 0.5
@@ -51,9 +131,7 @@ class AlarmManager:
         """
         Check if (x, y) is within a quadrilateral zone.
         """
-        from matplotlib.path import Path
-        polygon = Path(zone)
-        return polygon.contains_point((x, y))
+        return PolygonSet([zone]).contains_point(x, y)
 
     def trigger_alarm(self, tag_id, alarm_type, message):
         """
@@ -65,10 +143,12 @@ class AlarmManager:
         if alarm_type not in self.active_alarms[tag_id]:
             # Trigger the alarm for the first time
             self.active_alarms[tag_id][alarm_type] = True
-            print(f"ALARM: {message} for {tag_id}")
+            self.transitions += 1
+            if self.report:
+                print(f"ALARM: {message} for {tag_id}")
             # Add code to send the alarm information, e.g., logging or sending notifications
             #add_timestamp()
-            timestamp = time.time()
+            timestamp = self.clock()
             alert_name = alarm_type
             self.tag_manager.add_alert(tag_id, alert_name, message, timestamp)
             
@@ -80,60 +160,385 @@ class AlarmManager:
         """
         if tag_id in self.active_alarms and alarm_type in self.active_alarms[tag_id]:
             del self.active_alarms[tag_id][alarm_type]
+            self.transitions += 1
             self.tag_manager.remove_alert(tag_id, alarm_type)
 
     def check_forklift_operator_proximity(self, tag_a, tag_b):
         """
         Check proximity between a forklift and an operator (3-meter threshold).
         """
-        return self.check_proximity(tag_a, tag_b, threshold=3.0)
+        return self.check_proximity(tag_a, tag_b, threshold=FORKLIFT_OPERATOR_THRESHOLD)
 
     def check_crane_proximity(self, crane_a, crane_b):
         """
         Check proximity between two cranes (5-meter threshold).
         """
-        return self.check_proximity(crane_a, crane_b, threshold=5.0)
-
-    def run_alarm_checks(self, sequence_name, tags, cranes, geofence_zones):
-        for tag_id, tag in tags.items():
-            tag_type = tag['tag_type']
-            currently_in_geofence = self.check_geofence(tag, geofence_zones)
-            currently_in_crane_zone = self.check_crane_zone(tag, cranes)
-
-            # Proximity checks for all sequences
-            for other_tag_id, other_tag in tags.items():
-                if other_tag_id != tag_id and other_tag['tag_type'] == "Operator" and tag_type == "Forklift":
-                    close_to_operator = self.check_forklift_operator_proximity(tag, other_tag)
-                    if close_to_operator:
-                        self.trigger_alarm(tag_id, "forklift_operator_proximity", 
-                                           f"{tag_type} {tag_id} is too close to Operator {other_tag_id}")
-                    else:
-                        self.reset_alarm(tag_id, "forklift_operator_proximity")
-
-            # Alarm checks for geofence and crane zones
-            if tag_type in ["Operator", "Forklift"]:
-                if currently_in_geofence:
-                    self.trigger_alarm(tag_id, "geofence", "Entered geofence zone")
-                else:
-                    self.reset_alarm(tag_id, "geofence")
+        return self.check_proximity(crane_a, crane_b, threshold=CRANE_PROXIMITY_THRESHOLD)
+
+    def index_cranes(self, cranes):
+        """
+        Builds a grid of crane positions keyed by their index in cranes. The grid's max_radius
+        is the largest crane zone radius, so a query with it finds every zone a point may be in.
+        """
+        max_radius = max((crane['location'][2] for crane in cranes), default=0.0)
+        crane_grid = UniformGrid(max(max_radius, CRANE_PROXIMITY_THRESHOLD))
+        crane_grid.max_radius = max_radius
+        for i, crane in enumerate(cranes):
+            x, y, _ = crane['location']
+            crane_grid.insert(i, x, y)
+        return crane_grid
+
+    def run_alarm_checks(self, sequence_name, tags, cranes, geofence_zones, kinematics=None):
+        """
+        Runs every alarm check for one tick.
+
+        The checks are answered with uniform grids instead of comparing every pair of tags, but
+        the alarms are triggered and reset in exactly the order of the original pairwise loops
+        (see _check_runs), so the resulting alarms and alerts are unchanged. With incremental set,
+        run_incremental_alarm_checks is used instead.
 
-                if sequence_name != "Bricklayers Lift":  # Exclude Bricklayers Lift from crane zone checks
-                    if currently_in_crane_zone:
-                        self.trigger_alarm(tag_id, "crane_zone", "Entered crane zone")
-                    else:
-                        self.reset_alarm(tag_id, "crane_zone")
+        tags is a TagTable (the tags of a TagManager snapshot), whose type and position columns
+        the checks read directly, or a dict in the data.json 'tags' layout. kinematics is the
+        motion of the tags to use for this tick, e.g. a KinematicsSnapshot taken with the tags;
+        it defaults to self.kinematics.
+        """
+        if kinematics is None:
+            kinematics = self.kinematics
+        if self.incremental:
+            self.run_incremental_alarm_checks(sequence_name, tags, cranes, geofence_zones, kinematics)
+            return
+        tags = _as_table(tags)
+
+        # Operators in tag order; a forklift's proximity checks run over them in this order
+        operator_rows = tags.rows_of_type("Operator")
+        operator_ids = [tags.tag_id(row) for row in operator_rows.tolist()]
+        operator_ranks = {tag_id: rank for rank, tag_id in enumerate(operator_ids)}
+        operator_grid = UniformGrid(FORKLIFT_OPERATOR_THRESHOLD)
+        for tag_id, (x, y) in zip(operator_ids, tags.positions[operator_rows, :2].tolist()):
+            operator_grid.insert(tag_id, x, y)
+        crane_grid = self.index_cranes(cranes)
+
+        # Classify every operator and forklift against the geofence zones in one call. Only their
+        # checks can raise or clear an alarm, so the other tags are not visited at all.
+        zone_rows = tags.rows_of_type("Operator", "Forklift")
+        in_geofence = self.compile_zones(geofence_zones).contains_any(tags.positions[zone_rows, :2])
+
+        for tag_id, tag_type, (x, y), currently_in_geofence in zip(*tags.columns(zone_rows), in_geofence.tolist()):
+            self._check_tag(sequence_name, tag_id, tag_type, x, y, operator_grid, operator_ranks, operator_ids,
+                            currently_in_geofence, cranes, crane_grid)
 
         # Crane-to-crane proximity checks
         if sequence_name != "Tandem Lift":
-            for i, crane_a in enumerate(cranes):
-                for j, crane_b in enumerate(cranes):
-                    if i != j:
-                        close_to_another_crane = self.check_crane_proximity(crane_a, crane_b)
-                        if close_to_another_crane:
-                            self.trigger_alarm(i, "crane_proximity", "Crane proximity alert")
-                            self.trigger_alarm(j, "crane_proximity", "Crane proximity alert")
-                        else:
-                            self.reset_alarm(i, "crane_proximity")
-                            self.reset_alarm(j, "crane_proximity")
+            self.run_crane_proximity_checks(cranes, crane_grid)
+
+        # Predictive checks, using the current motion of the tags
+        if kinematics is not None:
+            self.run_time_to_collision_checks(sequence_name, tags, kinematics=kinematics)
+
+    def _check_tag(self, sequence_name, tag_id, tag_type, x, y, operator_grid, operator_ranks, operator_ids,
+                   currently_in_geofence, cranes, crane_grid):
+        # The per-tag checks of run_alarm_checks
+
+        # Proximity checks for all sequences
+        if tag_type == "Forklift":
+            close_ranks = sorted(operator_ranks[other_tag_id]
+                                 for other_tag_id in operator_grid.query(x, y, FORKLIFT_OPERATOR_THRESHOLD)
+                                 if other_tag_id != tag_id)
+            for rank, close_to_operator in _check_runs(len(operator_ids), close_ranks):
+                if close_to_operator:
+                    self.trigger_alarm(tag_id, "forklift_operator_proximity",
+                                       f"{tag_type} {tag_id} is too close to Operator {operator_ids[rank]}")
+                else:
+                    self.reset_alarm(tag_id, "forklift_operator_proximity")
+
+        # Alarm checks for geofence and crane zones
+        if tag_type in ["Operator", "Forklift"]:
+            if currently_in_geofence:
+                self.trigger_alarm(tag_id, "geofence", "Entered geofence zone")
+            else:
+                self.reset_alarm(tag_id, "geofence")
+
+            if sequence_name != "Bricklayers Lift":  # Exclude Bricklayers Lift from crane zone checks
+                currently_in_crane_zone = self._in_crane_zone(x, y, cranes, crane_grid)
+                if currently_in_crane_zone:
+                    self.trigger_alarm(tag_id, "crane_zone", "Entered crane zone")
+                else:
+                    self.reset_alarm(tag_id, "crane_zone")
+
+    def run_incremental_alarm_checks(self, sequence_name, tags, cranes, geofence_zones, kinematics=None):
+        """
+        Runs the alarm checks for one tick like run_alarm_checks, re-evaluating only what the tags
+        updated since the previous call can affect.
+
+        A check whose inputs have not changed makes the same trigger_alarm and reset_alarm calls
+        as last time. If none of those calls changed an alarm last time, they cannot now either,
+        so the check is skipped. A tag's checks are therefore re-run only when the tag itself
+        changed, when an operator moved within the proximity threshold of it (forklifts), when a
+        crane zone it is or was in moved (operators and forklifts), or when its checks changed an
+        alarm on the previous tick. Crane proximity and time-to-collision are re-run when any
+        crane, respectively any tag's motion, changed. The alarms are triggered and reset exactly
+        as, and in the same order as, run_alarm_checks would.
+
+        The tags updated since the previous call are the rows the registry has marked as changed
+        since the version it was at then (TagTable.changed_since), so the tags are never compared
+        one by one. That needs TagTables of the same registry (successive TagManager snapshots);
+        any other tags, such as a dict, start over. Likewise the motion of the tags has changed if
+        the version of the kinematics tracker (or of its snapshot) has.
+        """
+        if kinematics is None:
+            kinematics = self.kinematics
+        tags = _as_table(tags)
+        zones = self.compile_zones(geofence_zones)
+        inputs = self._inputs
+        if (inputs is None or inputs.sequence_name != sequence_name or inputs.zones is not zones or
+                inputs.epoch is not tags.epoch):
+            # Start over: every tag counts as changed
+            inputs = self._inputs = _AlarmInputs(sequence_name, zones, tags.epoch)
+        previous = inputs.tags
+        positions, type_codes = tags.positions, tags.type_codes
+        operator_code, forklift_code = tags.type_code("Operator"), tags.type_code("Forklift")
+
+        # The tags updated since the previous tick, as recorded by the registry
+        changed_rows = tags.changed_since(inputs.version).tolist()
+        changed = [tags.tag_id(row) for row in changed_rows]
+
+        # Keep the operator and forklift grids up to date
+        for row, tag_id in zip(changed_rows, changed):
+            for grid in (inputs.operator_grid, inputs.forklift_grid):
+                if tag_id in grid.points:
+                    grid.remove(tag_id)
+            if type_codes[row] in (operator_code, forklift_code):
+                grid = inputs.operator_grid if type_codes[row] == operator_code else inputs.forklift_grid
+                x, y, _ = positions[row].tolist()
+                grid.insert(tag_id, x, y)
+
+        def zone_tags_near(x, y, radius):
+            return inputs.operator_grid.query(x, y, radius) + inputs.forklift_grid.query(x, y, radius)
+
+        affected = set(changed) | inputs.unsettled
+
+        # Forklifts near where a moved operator was or is now
+        operator_rows = tags.rows_of_type("Operator")
+        if inputs.operator_rows is not None and np.array_equal(operator_rows, inputs.operator_rows):
+            operator_ids = inputs.operator_ids
+            for row in changed_rows:
+                if type_codes[row] == operator_code:
+                    for x, y, _ in (previous.positions[row].tolist(), positions[row].tolist()):
+                        affected.update(inputs.forklift_grid.query(x, y, FORKLIFT_OPERATOR_THRESHOLD))
+        else:
+            operator_ids = [tags.tag_id(row) for row in operator_rows.tolist()]
+            affected.update(inputs.forklift_grid.points)  # The order of the checks has changed
+
+        # Operators and forklifts in the old or new zone of a moved crane
+        crane_locations = [tuple(crane['location']) for crane in cranes]
+        previous_crane_locations = inputs.crane_locations
+        cranes_changed = crane_locations != previous_crane_locations
+        if previous_crane_locations is None or len(crane_locations) != len(previous_crane_locations):
+            affected.update(inputs.operator_grid.points)
+            affected.update(inputs.forklift_grid.points)
+        elif cranes_changed:
+            for old, new in zip(previous_crane_locations, crane_locations):
+                if old != new:
+                    affected.update(zone_tags_near(old[0], old[1], old[2]))
+                    affected.update(zone_tags_near(new[0], new[1], new[2]))
+
+        # Only operators and forklifts have per-tag checks; visit the affected ones in tag order
+        operator_ranks = {tag_id: rank for rank, tag_id in enumerate(operator_ids)}
+        crane_grid = self.index_cranes(cranes)
+        affected_rows = np.array(sorted(row for row in map(tags.row, affected) if row is not None), dtype=np.int64)
+        zone_rows = affected_rows[np.isin(type_codes[affected_rows], [operator_code, forklift_code])]
+        in_geofence = zones.contains_any(positions[zone_rows, :2])
+
+        unsettled = set()
+        for tag_id, tag_type, (x, y), currently_in_geofence in zip(*tags.columns(zone_rows), in_geofence.tolist()):
+            transitions = self.transitions
+            self._check_tag(sequence_name, tag_id, tag_type, x, y, inputs.operator_grid, operator_ranks, operator_ids,
+                            currently_in_geofence, cranes, crane_grid)
+            if self.transitions != transitions:
+                unsettled.add(tag_id)
+
+        # Crane-to-crane proximity checks
+        if sequence_name != "Tandem Lift" and (cranes_changed or inputs.cranes_unsettled):
+            transitions = self.transitions
+            self.run_crane_proximity_checks(cranes, crane_grid)
+            inputs.cranes_unsettled = self.transitions != transitions
+
+        # Predictive checks, using the current motion of the tags
+        if kinematics is not None:
+            version = getattr(kinematics, 'version', None)
+            if version is not None:
+                motion = (version, type_codes.tobytes())
+            else:
+                # No version to go by: compare the motion of every tag
+                motion = ([(tag_id, kinematics.get(tag_id)) for tag_id in tags], type_codes.tobytes())
+            if motion != inputs.kinematics or inputs.time_to_collision_unsettled:
+                transitions = self.transitions
+                self.run_time_to_collision_checks(sequence_name, tags, kinematics=kinematics)
+                inputs.time_to_collision_unsettled = self.transitions != transitions
+            inputs.kinematics = motion
+
+        inputs.tags = tags
+        inputs.version = tags.version
+        inputs.operator_rows = operator_rows
+        inputs.operator_ids = operator_ids
+        inputs.crane_locations = crane_locations
+        inputs.unsettled = unsettled
+
+    def run_crane_proximity_checks(self, cranes, crane_grid):
+        """
+        Crane-to-crane proximity alarms, keyed by crane index.
+
+        The original check visits every ordered pair (i, j) and triggers or resets both i and j.
+        Crane k therefore sees the pairs (c, k) for c < k, then (k, c) for every c, then (c, k)
+        for c > k. Only the changes between close and far along that sequence have an effect,
+        so those are generated from the close pairs and replayed in pair order.
+        """
+        n = len(cranes)
+        events = []
+        for k, crane in enumerate(cranes):
+            x, y, _ = crane['location']
+            close_positions = []
+            for c in crane_grid.query(x, y, CRANE_PROXIMITY_THRESHOLD):
+                if c == k:
+                    continue
+                if c < k:
+                    close_positions.append(c)
+                    close_positions.append(k + c)
+                else:
+                    close_positions.append(k + c - 1)
+                    close_positions.append(n + c - 2)
+            close_positions.sort()
+
+            for position, close in _check_runs(2 * (n - 1), close_positions):
+                # Map the position in crane k's sequence back to (pair, side) in the original loop order
+                if position < k:
+                    key = (position * n + k, 1)
+                elif position < k + n - 1:
+                    c = position - k
+                    c = c if c < k else c + 1
+                    key = (k * n + c, 0)
+                else:
+                    c = position - (n - 1) + 1
+                    key = (c * n + k, 1)
+                events.append((key, k, close))
+
+        events.sort()
+        for _, k, close in events:
+            if close:
+                self.trigger_alarm(k, "crane_proximity", "Crane proximity alert")
+            else:
+                self.reset_alarm(k, "crane_proximity")
+
+    def run_time_to_collision_checks(self, sequence_name, tags, horizon=TIME_TO_COLLISION_HORIZON, kinematics=None):
+        """
+        Predictive alarms for forklifts and operators, and for cranes, that are about to come
+        within their proximity threshold of each other.
+
+        Each tag's recent motion (from the kinematics tracker) is extrapolated at constant
+        velocity, and a "time_to_collision" alarm is raised for both tags of a pair when they are
+        not within the threshold yet but will be within horizon seconds. Pairs that are already
+        too close are left to the proximity alarms. All pairs are evaluated at once with arrays.
+        """
+        # The current motion of the tags, dropping tags that have not reported recently
+        if kinematics is None:
+            kinematics = self.kinematics
+        tags = _as_table(tags)
+        tag_ids = list(tags)
+        states = {}
+        for row, tag_id in enumerate(tag_ids):
+            state = kinematics.get(tag_id)
+            if state is not None:
+                states[tag_id] = (row, state)
+        now = max((state.timestamp for _, state in states.values()), default=None)
+        groups = {"Forklift": [], "Operator": [], "Crane": []}
+        for tag_id, (row, state) in states.items():
+            tag_type = tags.tag_type(row)
+            if tag_type in groups and now - state.timestamp <= TIME_TO_COLLISION_MAX_AGE:
+                groups[tag_type].append(tag_id)
+        states = {tag_id: state for tag_id, (_, state) in states.items()}
+
+        pairings = [("Forklift", "Operator", FORKLIFT_OPERATOR_THRESHOLD)]
+        if sequence_name != "Tandem Lift":  # Same exclusion as the crane proximity checks
+            pairings.append(("Crane", "Crane", CRANE_PROXIMITY_THRESHOLD))
+
+        # Earliest predicted collision of each tag, as (time, other tag, threshold)
+        predictions = {}
+        for type_a, type_b, threshold in pairings:
+            ids_a, ids_b = groups[type_a], groups[type_b]
+            if not ids_a or not ids_b:
+                continue
+            motion_a, motion_b = self._extrapolate(states, ids_a, now), self._extrapolate(states, ids_b, now)
+            times = predict_time_to_collision(*motion_a, *motion_b, threshold, horizon)
+            times[times == 0] = np.inf  # Already too close
+            if type_a == type_b:
+                np.fill_diagonal(times, np.inf)
+
+            for ids, others, axis in ((ids_a, ids_b, 1), (ids_b, ids_a, 0)):
+                nearest = times.argmin(axis=axis)
+                earliest = times.min(axis=axis)
+                for tag_id, other, ttc in zip(ids, nearest.tolist(), earliest.tolist()):
+                    if ttc < predictions.get(tag_id, (np.inf,))[0]:
+                        predictions[tag_id] = (ttc, others[other], threshold)
+
+        for row, tag_id in enumerate(tag_ids):
+            if tag_id in predictions:
+                ttc, other_id, threshold = predictions[tag_id]
+                self.trigger_alarm(tag_id, "time_to_collision",
+                                   f"{tags.tag_type(row)} {tag_id} will be within {threshold:g} m of "
+                                   f"{tags.tag_type(tags.row(other_id))} {other_id} in {ttc:.1f} s")
+            else:
+                self.reset_alarm(tag_id, "time_to_collision")
+
+    def _extrapolate(self, states, tag_ids, now):
+        # (positions, velocities) as (N, 2) arrays, with each position moved forward to now
+        motion = np.array([(state.x, state.y, state.vx, state.vy, now - state.timestamp)
+                           for state in (states[tag_id] for tag_id in tag_ids)])
+        velocities = motion[:, 2:4]
+        return motion[:, 0:2] + velocities * motion[:, 4:5], velocities
+
+
+def predict_time_to_collision(positions_a, velocities_a, positions_b, velocities_b, threshold, horizon):
+    """
+    Predicts when pairs of tags moving at constant velocity first come closer than threshold.
+
+    :param positions_a, velocities_a: (A, 2) arrays of X, Y positions (m) and velocities (m/s).
+    :param positions_b, velocities_b: (B, 2) arrays for the other tags of each pair.
+    :param threshold: Distance in metres.
+    :param horizon: Number of seconds to look ahead.
+    :return: (A, B) array of the time in seconds until each pair is closer than threshold: 0 if it
+             already is, and inf if it will not be within horizon.
+    """
+    offsets = positions_b[np.newaxis, :, :] - positions_a[:, np.newaxis, :]
+    closing = velocities_b[np.newaxis, :, :] - velocities_a[:, np.newaxis, :]
+
+    # Solve |offset + closing * t| = threshold for the first t
+    a = (closing ** 2).sum(axis=2)
+    b = (offsets * closing).sum(axis=2)
+    c = (offsets ** 2).sum(axis=2) - threshold ** 2
+    discriminant = b ** 2 - a * c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entry = (-b - np.sqrt(discriminant)) / a
+    times = np.where((a > 0) & (discriminant > 0) & (entry >= 0) & (entry <= horizon), entry, np.inf)
+    return np.where(c < 0, 0.0, times)
+
+
+def _check_runs(length, close_positions):
+    """
+    Compresses a sequence of `length` proximity checks into the ones that can change an alarm.
 
+    Each check triggers the alarm when close and resets it when far. Repeating a reset has no
+    effect, so for each run of far checks only its first one is yielded, together with every
+    close check (all but the first of a run are no-ops, but they are cheap).
 
+    :param length: Number of checks in the sequence.
+    :param close_positions: Sorted positions of the close checks.
+    :return: Generator of (position, close) pairs in sequence order.
+    """
+    previous = -1
+    for position in close_positions:
+        if position > previous + 1:
+            yield previous + 1, False
+        yield position, True
+        previous = position
+    if previous < length - 1:
+        yield previous + 1, False
@@ -0,0 +1,229 @@
+import numpy as np
+
+# Extents of the site map in metres, in the form (X_min, X_max, Y_min, Y_max, Z_min, Z_max)
+SITE_RANGE = (0.00, 74.25, 0.00, 34.20, 0.50, 7.15)
+
+AXES = ('x', 'y', 'z')
+
+
+def getColumnBounds(table):
+    """
+    Vectorised equivalent of main.getCoordinateBounds for a CoordinateTable.
+
+    Args:
+    table (CoordinateTable): The coordinate data. Rows without a valid X, Y and Z are ignored.
+
+    Returns:
+    tuple: (xLow, xHigh, yLow, yHigh, zLow, zHigh), or a tuple of None if there are no valid rows.
+    """
+    records = table.records
+    valid = np.isfinite(records['x']) & np.isfinite(records['y']) & np.isfinite(records['z'])
+    if not valid.any():
+        return (None,) * 6
+
+    bounds = []
+    for axis in AXES:
+        column = records[axis][valid]
+        bounds.extend((float(column.min()), float(column.max())))
+    return tuple(bounds)
+
+
+def getStreamBounds(tables):
+    """
+    getColumnBounds over a stream of CoordinateTables (e.g. the batches of iterCoordinateBatches),
+    holding one table at a time. The result is the same as for the tables joined together.
+    """
+    bounds = (None,) * 6
+    for table in tables:
+        table_bounds = getColumnBounds(table)
+        if table_bounds[0] is None:
+            continue
+        if bounds[0] is None:
+            bounds = table_bounds
+            continue
+        bounds = tuple(min(old, new) if i % 2 == 0 else max(old, new)
+                       for i, (old, new) in enumerate(zip(bounds, table_bounds)))
+    return bounds
+
+
+def stretchColumns(table, previous_range, new_range, inplace=True):
+    """
+    Vectorised equivalent of main.stretchData: rescales the X, Y, Z columns from previous_range
+    to new_range. An axis whose previous range is empty is left unchanged.
+
+    Args:
+    table (CoordinateTable): The coordinate data to be rescaled.
+    previous_range (tuple): (X_min, X_max, Y_min, Y_max, Z_min, Z_max) of the data as recorded.
+    new_range (tuple): (X_min, X_max, Y_min, Y_max, Z_min, Z_max) to rescale to.
+    inplace (bool): Rescale the columns of table itself rather than of a copy.
+
+    Returns:
+    CoordinateTable: The rescaled table (table itself if inplace is True).
+    """
+    if not inplace:
+        table = table.copy()
+
+    for i, axis in enumerate(AXES):
+        old_min, old_max = previous_range[2 * i], previous_range[2 * i + 1]
+        new_min, new_max = new_range[2 * i], new_range[2 * i + 1]
+        if old_max - old_min == 0:
+            continue  # Avoid division by zero, keep the values if the old range is zero
+
+        # Same order of operations as stretchData so the results are identical
+        column = table.records[axis]
+        column -= old_min
+        column /= (old_max - old_min)
+        column *= (new_max - new_min)
+        column += new_min
+
+    return table
+
+
+def normalizeCoordinates(table, new_range=SITE_RANGE, previous_range=None, inplace=True):
+    """
+    Rescales a CoordinateTable onto the site and drops rows that cannot be replayed.
+
+    With previous_range=None the recorded extents are found with a bounds scan, as main.py
+    has always done. Passing a known previous_range (a fixed calibration) skips the scan.
+
+    Args:
+    table (CoordinateTable): The coordinate data to be normalised.
+    new_range (tuple): Extents to rescale to. Defaults to the site map.
+    previous_range (tuple): Recorded extents of the data, if already known.
+    inplace (bool): Rescale the columns of table itself rather than of a copy.
+
+    Returns:
+    tuple: (CoordinateTable, previous_range) - the normalised rows with a valid position and
+           timestamp, and the recorded extents that were used.
+    """
+    if previous_range is None:
+        previous_range = getColumnBounds(table)
+        if previous_range[0] is None:
+            raise ValueError("No valid coordinates found to calibrate against.")
+
+    table = stretchColumns(table, previous_range, new_range, inplace=inplace)
+
+    valid = table.valid_mask()
+    if not valid.all():
+        table = table.take(valid)
+    return table, previous_range
+
+
+def getDatasetCalibration(sequence_data, dataset_name):
+    """
+    Returns the recorded extents (X_min, X_max, Y_min, Y_max, Z_min, Z_max) stored for a dataset
+    under "calibration" in sequence_data.json, or None if the dataset has no stored calibration.
+    """
+    dataset = sequence_data.get('data_set', {}).get(dataset_name, {})
+    calibration = dataset.get('calibration')
+    return tuple(calibration) if calibration is not None else None
+
+
+class OnlineCalibration:
+    """
+    Rescales coordinates onto the site one record or one batch at a time, using constant memory.
+
+    With a fixed previous_range (e.g. from sequence_data.json) the transform never changes and any
+    record outside the calibrated extents is reported. Without one, the extents are the running
+    bounds of everything seen so far; each record that widens them is reported, and the transform
+    settles as the bounds stabilise.
+    """
+    def __init__(self, new_range=SITE_RANGE, previous_range=None, tolerance=0.0, on_out_of_range=None):
+        """
+        :param new_range: Extents to rescale to. Defaults to the site map.
+        :param previous_range: Fixed recorded extents. None to calibrate from running bounds.
+        :param tolerance: Distance in metres a fixed-calibration record may lie outside the extents before it is reported.
+        :param on_out_of_range: Optional callback called with (tag_id, x, y, z) for every reported record.
+        """
+        self.new_range = tuple(new_range)
+        self.fixed = previous_range is not None
+        self.tolerance = tolerance
+        self.on_out_of_range = on_out_of_range
+        self.records = 0
+        self.out_of_range = 0
+
+        if self.fixed:
+            self.bounds = np.array(previous_range, dtype=np.float64)
+        else:
+            self.bounds = np.array([np.inf, -np.inf] * 3, dtype=np.float64)
+        self._update_transform()
+
+    @classmethod
+    def from_sequence_data(cls, sequence_data, dataset_name, **kwargs):
+        """Creates a calibration from the dataset's stored extents, falling back to running bounds."""
+        return cls(previous_range=getDatasetCalibration(sequence_data, dataset_name), **kwargs)
+
+    def previous_range(self):
+        """Returns the recorded extents currently in use."""
+        return tuple(float(bound) for bound in self.bounds)
+
+    def _update_transform(self):
+        # value * scale + offset, per axis; an empty range leaves the axis unchanged like stretchData
+        lows, highs = self.bounds[0::2], self.bounds[1::2]
+        new_lows, new_highs = np.array(self.new_range[0::2]), np.array(self.new_range[1::2])
+        spans = highs - lows
+        usable = np.isfinite(spans) & (spans != 0)
+        self.scale = np.where(usable, (new_highs - new_lows) / np.where(usable, spans, 1.0), 1.0)
+        self.offset = np.where(usable, new_lows - lows * self.scale, 0.0)
+
+    def _report(self, tag_ids, points):
+        self.out_of_range += len(points)
+        if self.on_out_of_range is not None:
+            for tag_id, (x, y, z) in zip(tag_ids, points):
+                self.on_out_of_range(tag_id, x, y, z)
+
+    def apply(self, positions, tag_ids=None):
+        """
+        Rescales an (N, 3) array of raw X, Y, Z positions. Rows containing NaN are passed through.
+
+        :param positions: Raw positions, one row per record.
+        :param tag_ids: Optional tag id per row, passed to on_out_of_range.
+        :return: A new (N, 3) array of site coordinates.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        valid = np.isfinite(positions).all(axis=1)
+        self.records += int(valid.sum())
+        lows, highs = self.bounds[0::2], self.bounds[1::2]
+
+        if self.fixed:
+            outside = valid & ((positions < lows - self.tolerance) | (positions > highs + self.tolerance)).any(axis=1)
+        else:
+            # Records that widen the running bounds, in order of arrival. The first record seen
+            # only initialises the bounds and is not reported.
+            low_so_far = np.minimum.accumulate(np.vstack([lows, np.where(valid[:, None], positions, np.inf)]), axis=0)
+            high_so_far = np.maximum.accumulate(np.vstack([highs, np.where(valid[:, None], positions, -np.inf)]), axis=0)
+            previous_low, previous_high = low_so_far[:-1], high_so_far[:-1]
+            outside = valid & np.isfinite(previous_low).all(axis=1) & (
+                (positions < previous_low) | (positions > previous_high)).any(axis=1)
+            self.bounds[0::2] = low_so_far[-1]
+            self.bounds[1::2] = high_so_far[-1]
+            self._update_transform()
+
+        if outside.any():
+            ids = np.asarray(tag_ids, dtype=object)[outside] if tag_ids is not None else [None] * int(outside.sum())
+            self._report(ids, positions[outside].tolist())
+
+        return positions * self.scale + self.offset
+
+    def apply_row(self, row):
+        """
+        Rescales one row in the getCoordinateData layout.
+
+        :return: A new row with float X, Y, Z (as after main.stretchData), or None if the position is not numeric.
+        """
+        try:
+            position = (float(row[2]), float(row[3]), float(row[4]))
+        except (ValueError, IndexError):
+            return None
+        x, y, z = self.apply([position], [row[1]])[0].tolist()
+        return [row[0], row[1], x, y, z, row[5], row[6]]
+
+    def apply_table(self, table):
+        """Rescales the X, Y, Z columns of a CoordinateTable (e.g. one streamed batch) in place."""
+        records = table.records
+        positions = np.column_stack([records['x'], records['y'], records['z']])
+        tag_ids = [table.tags.value(code) for code in records['tag']] if self.on_out_of_range is not None else None
+        rescaled = self.apply(positions, tag_ids)
+        for i, axis in enumerate(AXES):
+            records[axis] = rescaled[:, i]
+        return table
@@ -1,4 +1,71 @@
 import csv
+import os
+import numpy as np
+
+# Column layout of a parsed coordinate log. Tag serial numbers and information
+# strings are interned to small integer codes (see StringIndex) so that every
+# column is a fixed-width number and the whole log fits in one typed array.
+COORDINATE_DTYPE = np.dtype([
+    ('seq', np.int32),          # Sequence Number (-1 if missing)
+    ('tag', np.int16),          # Tag's Serial Number, as a code into CoordinateTable.tags
+    ('x', np.float64),          # Position X (NaN if missing)
+    ('y', np.float64),          # Position Y (NaN if missing)
+    ('z', np.float64),          # Position Z (NaN if missing)
+    ('info', np.int16),         # Information String code, 0 means no information string
+    ('timestamp', np.float64),  # Calculation's Timestamp (NaN if missing)
+])
+
+
+def parseCoordinateLine(line):
+    """
+    Parses a single line of a PEKIO log.
+
+    Args:
+    line (str): A raw line from a log file or TCP stream.
+
+    Returns:
+    list or None: The extracted fields in the order
+                  [Sequence Number, Tag Serial Number, Position X, Position Y, Position Z, Information String, Calculation Timestamp],
+                  or None if the line is not a usable $PEKIO,COORD report.
+    """
+    # Remove any leading/trailing whitespace characters (like newline)
+    line = line.strip()
+
+    # Check if the line starts with the expected log prefix
+    if not line.startswith('$PEKIO,COORD'):
+        return None
+
+    # Check if the line contains the word "Math" and skip it if it does
+    if 'Math' in line:
+        return None
+
+    # Split the line by commas to extract individual fields
+    fields = line.split(',')
+
+    # Sequence Number (index 2) and Tag’s Serial Number (index 3)
+    sequence_number = fields[2]
+    tag_serial_number = fields[3]
+
+    # Tag’s Position: the fifth to seventh items in the split list (indexes 4 to 6)
+    # This can be empty, so default to empty strings if not present
+    position_x = fields[4] if len(fields) > 4 else ''
+    position_y = fields[5] if len(fields) > 5 else ''
+    position_z = fields[6] if len(fields) > 6 else ''
+
+    # Information String (index 7) and Calculation’s Timestamp (index 8)
+    information_string = fields[7] if len(fields) > 7 else ''
+    calculation_timestamp = fields[8] if len(fields) > 8 else ''
+
+    return [
+        sequence_number,           # Column 0: Sequence Number
+        tag_serial_number,        # Column 1: Tag’s Serial Number
+        position_x,               # Column 2: Position X
+        position_y,               # Column 3: Position Y
+        position_z,               # Column 4: Position Z
+        information_string,       # Column 5: Information String
+        calculation_timestamp     # Column 6: Calculation’s Timestamp
+    ]
+
 
 def getCoordinateData(log_file_path):
     """
@@ -17,48 +84,250 @@ def getCoordinateData(log_file_path):
     # Open and read the log file
     with open(log_file_path, 'r') as file:
         for line in file:
-            # Remove any leading/trailing whitespace characters (like newline)
-            line = line.strip()
-            
-            # Check if the line starts with the expected log prefix
-            if line.startswith('$PEKIO,COORD'):
-                # Check if the line contains the word "Math" and skip it if it does
-                if 'Math' in line:
-                    continue
-
-                # Split the line by commas to extract individual fields
-                fields = line.split(',')
-
-                # Extract relevant data from the fields
-                # Sequence Number: the third item in the split list (index 2)
-                sequence_number = fields[2]
-
-                # Tag’s Serial Number: the fourth item in the split list (index 3)
-                tag_serial_number = fields[3]
-
-                # Tag’s Position: the fifth to seventh items in the split list (indexes 4 to 6)
-                # This can be empty, so default to empty strings if not present
-                position_x = fields[4] if len(fields) > 4 else ''
-                position_y = fields[5] if len(fields) > 5 else ''
-                position_z = fields[6] if len(fields) > 6 else ''
-
-                # Information String: the eighth item in the split list (index 7)
-                # It may be empty, so default to an empty string if not present
-                information_string = fields[7] if len(fields) > 7 else ''
-
-                # Calculation’s Timestamp: the ninth item in the split list (index 8)
-                calculation_timestamp = fields[8] if len(fields) > 8 else ''
-
+            row = parseCoordinateLine(line)
+            if row is not None:
                 # Append the extracted data as a row in the matrix
-                coordinateData.append([
-                    sequence_number,           # Column 0: Sequence Number
-                    tag_serial_number,        # Column 1: Tag’s Serial Number
-                    position_x,               # Column 2: Position X
-                    position_y,               # Column 3: Position Y
-                    position_z,               # Column 4: Position Z
-                    information_string,       # Column 5: Information String
-                    calculation_timestamp     # Column 6: Calculation’s Timestamp
-                ])
+                coordinateData.append(row)
 
     # Return the matrix of coordinate data
-    return coordinateData
\ No newline at end of file
+    return coordinateData
+
+
+class StringIndex:
+    """
+    Interns strings (tag serial numbers, information strings) to small integer codes.
+    Codes are handed out in order of first appearance and never change, so an index
+    can be shared by several tables (e.g. consecutive batches of the same log).
+    """
+    def __init__(self, values=()):
+        self.codes = {}
+        self.values = []
+        for value in values:
+            self.code(value)
+
+    def code(self, value):
+        """Returns the code for value, assigning the next free code if it is new."""
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def value(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class CoordinateTable:
+    """
+    Columnar view of parsed coordinate data.
+
+    The data lives in a single structured NumPy array (see COORDINATE_DTYPE); tag serial
+    numbers and information strings are stored as codes into the shared `tags` and `infos`
+    indexes. Numeric columns are available directly, e.g. `table['x']` or `table.timestamps`.
+
+    For compatibility the table also behaves like the list of lists returned by
+    getCoordinateData: len(), iteration and integer indexing yield 7-element rows,
+    and slicing returns a new table that shares memory with this one.
+    """
+    def __init__(self, records, tags=None, infos=None):
+        self.records = records
+        self.tags = tags if tags is not None else StringIndex()
+        self.infos = infos if infos is not None else StringIndex([''])
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    def valid_mask(self):
+        """Returns a boolean mask of rows whose position and timestamp all parsed as numbers."""
+        records = self.records
+        return (np.isfinite(records['x']) & np.isfinite(records['y']) &
+                np.isfinite(records['z']) & np.isfinite(records['timestamp']))
+
+    def tag_code(self, serial_number):
+        """Returns the code of a tag serial number, or None if the tag does not appear in the table."""
+        return self.tags.codes.get(serial_number)
+
+    def take(self, index):
+        """Returns a new table holding the rows selected by a boolean mask or an index array."""
+        return CoordinateTable(self.records[index], self.tags, self.infos)
+
+    def copy(self):
+        """Returns a table with its own copy of the records."""
+        return CoordinateTable(self.records.copy(), self.tags, self.infos)
+
+    def row(self, index):
+        """
+        Returns one row in the list-of-lists layout. Positions are returned as floats (as after
+        main.stretchData); every other column, and any missing value, is returned as a string.
+        """
+        record = self.records[index]
+        return [
+            str(record['seq']) if record['seq'] >= 0 else '',
+            self.tags.value(record['tag']),
+            _format_number(record['x']),
+            _format_number(record['y']),
+            _format_number(record['z']),
+            self.infos.value(record['info']),
+            _format_timestamp(record['timestamp'])
+        ]
+
+    def to_list(self):
+        """Materialises the whole table in the list-of-lists layout."""
+        return [self.row(i) for i in range(len(self.records))]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        for i in range(len(self.records)):
+            yield self.row(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, str):
+            return self.records[index]
+        if isinstance(index, slice):
+            return CoordinateTable(self.records[index], self.tags, self.infos)
+        return self.row(index)
+
+
+def _format_number(value):
+    value = float(value)
+    return '' if np.isnan(value) else value
+
+
+def _format_timestamp(value):
+    value = float(value)
+    return '' if np.isnan(value) else repr(value)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return -1
+
+
+def buildCoordinateTable(rows, tags=None, infos=None):
+    """
+    Converts rows in the getCoordinateData layout into a CoordinateTable.
+
+    Args:
+    rows (iterable of lists): Rows of 7 string fields, as produced by parseCoordinateLine.
+    tags (StringIndex): Optional tag index to share with other tables.
+    infos (StringIndex): Optional information string index to share with other tables.
+
+    Returns:
+    CoordinateTable: The parsed rows. Fields that are not valid numbers become NaN (or -1 for the sequence number).
+    """
+    tags = tags if tags is not None else StringIndex()
+    infos = infos if infos is not None else StringIndex([''])
+
+    parsed = [
+        (_to_int(row[0]), tags.code(row[1]), _to_float(row[2]), _to_float(row[3]),
+         _to_float(row[4]), infos.code(row[5]), _to_float(row[6]))
+        for row in rows
+    ]
+    records = np.array(parsed, dtype=COORDINATE_DTYPE)
+    return CoordinateTable(records, tags, infos)
+
+
+def getCoordinateTable(log_file_path):
+    """
+    Extracts coordinate data from a log file into a columnar CoordinateTable.
+
+    Every field is parsed exactly once, so later stages can work on the float columns
+    directly instead of calling float() on the strings returned by getCoordinateData. The log is
+    read with iterCoordinateBatches, so only one batch of parsed lines is held besides the records.
+
+    Args:
+    log_file_path (str): Path to the log file to be read.
+
+    Returns:
+    CoordinateTable: The coordinate data, one record per $PEKIO,COORD line.
+    """
+    return concatCoordinateTables(iterCoordinateBatches(log_file_path))
+
+
+def iterCoordinateBatches(log_file_path, batch_size=4096, start=0, stop=None, tags=None, infos=None):
+    """
+    Streams a log file as CoordinateTable batches of at most batch_size records.
+
+    The file is memory-mapped and scanned line by line, so only one batch is held in memory
+    at a time regardless of the size of the log. The same $PEKIO,COORD filtering and "Math"
+    row skipping as getCoordinateData is applied.
+
+    A byte range can be given to read part of a file: a line belongs to the range if it
+    starts at an offset in [start, stop). Splitting a file at arbitrary offsets therefore
+    yields every line exactly once across the pieces.
+
+    Args:
+    log_file_path (str): Path to the log file to be read.
+    batch_size (int): Maximum number of records per batch.
+    start (int): Byte offset to start reading from.
+    stop (int): Byte offset to stop at. Defaults to the end of the file.
+    tags (StringIndex): Optional tag index; a new one is shared by all batches if not given.
+    infos (StringIndex): Optional information string index, shared like tags.
+
+    Yields:
+    CoordinateTable: Consecutive batches of coordinate data.
+    """
+    import mmap
+
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1.")
+
+    tags = tags if tags is not None else StringIndex()
+    infos = infos if infos is not None else StringIndex([''])
+
+    with open(log_file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        stop = size if stop is None else min(stop, size)
+        if size == 0 or start >= stop:
+            return
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = start
+            # A line that began before start belongs to the previous range
+            if position > 0 and mapped[position - 1:position] != b'\n':
+                newline = mapped.find(b'\n', position)
+                position = size if newline == -1 else newline + 1
+
+            rows = []
+            while position < stop:
+                newline = mapped.find(b'\n', position)
+                end = size if newline == -1 else newline + 1
+                row = parseCoordinateLine(mapped[position:end].decode('utf-8', errors='replace'))
+                position = end
+
+                if row is not None:
+                    rows.append(row)
+                    if len(rows) == batch_size:
+                        yield buildCoordinateTable(rows, tags, infos)
+                        rows = []
+
+            if rows:
+                yield buildCoordinateTable(rows, tags, infos)
+
+
+def concatCoordinateTables(tables):
+    """
+    Joins CoordinateTables that share the same tag and information string indexes
+    (such as the batches of iterCoordinateBatches) into a single table.
+    """
+    tables = list(tables)
+    if not tables:
+        return CoordinateTable(np.empty(0, dtype=COORDINATE_DTYPE))
+    records = np.concatenate([table.records for table in tables])
+    return CoordinateTable(records, tables[0].tags, tables[0].infos)
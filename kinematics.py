@@ -0,0 +1,210 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from velocity import MAX_VELOCITY_KMPH
+
+# Current motion of a tag. Positions are in metres, velocities in m/s, heading in degrees
+# counterclockwise from the +X axis and acceleration (the rate of change of speed) in m/s^2.
+TagKinematics = namedtuple('TagKinematics', ['timestamp', 'x', 'y', 'z', 'vx', 'vy', 'speed', 'heading', 'acceleration'])
+
+SMOOTHING_METHODS = (None, 'ema', 'kalman')
+
+# Below this speed (m/s) a tag is treated as stationary and keeps its last heading
+STATIONARY_SPEED = 0.05
+
+
+class KinematicsSnapshot(dict):
+    """
+    Copy of the current TagKinematics of every tag, keyed by tag id. It has the same accessors as
+    KinematicsTracker, so it can stand in for the tracker on a thread that must not see it change.
+    """
+    version = None  # KinematicsTracker.version the snapshot was taken at, if it came from a tracker
+
+    def speed(self, tag_id):
+        kinematics = self.get(tag_id)
+        return kinematics.speed if kinematics is not None else None
+
+    def speed_kmph(self, tag_id):
+        speed = self.speed(tag_id)
+        return speed * 3.6 if speed is not None else None
+
+
+class _Track:
+    # Motion state of one tag
+    __slots__ = ('history', 'head', 'count', 'timestamp', 'x', 'y', 'z', 'vx', 'vy', 'speed', 'heading',
+                 'acceleration', 'kalman')
+
+    def __init__(self, capacity):
+        self.history = np.empty((capacity, 4))  # Ring buffer of (timestamp, x, y, z)
+        self.head = 0
+        self.count = 0
+        self.timestamp = self.x = self.y = self.z = None
+        self.vx = self.vy = self.speed = self.acceleration = 0.0
+        self.heading = None
+        self.kalman = None  # Per axis [position, velocity, P00, P01, P11]
+
+
+class KinematicsTracker:
+    """
+    Tracks the speed, heading and acceleration of every tag from its position reports.
+
+    Each report is processed in constant time and memory: the tracker keeps the current motion
+    of each tag and a fixed-size ring buffer of its last positions, never the whole history.
+    Velocities can be smoothed with an exponential moving average or a constant-velocity Kalman
+    filter, which copes better with irregular report intervals. Reports that imply an absurd
+    speed (as filtered by exportVelocity) or that are not newer than the last one are ignored.
+    """
+    def __init__(self, history=32, smoothing='ema', alpha=0.3, process_noise=1.0, measurement_noise=0.05,
+                 max_velocity_kmph=MAX_VELOCITY_KMPH):
+        """
+        :param history: Number of recent positions kept per tag.
+        :param smoothing: None for raw velocities between consecutive reports, 'ema' or 'kalman'.
+        :param alpha: Weight of the newest velocity in the exponential moving average.
+        :param process_noise: Kalman filter acceleration variance in (m/s^2)^2; higher follows manoeuvres faster.
+        :param measurement_noise: Kalman filter position variance in m^2 of the positioning system.
+        :param max_velocity_kmph: Reports implying a higher speed are treated as glitches and ignored.
+        """
+        if smoothing not in SMOOTHING_METHODS:
+            raise ValueError(f"Invalid smoothing: {smoothing}. Choose from {list(SMOOTHING_METHODS)}.")
+        if history < 1:
+            raise ValueError("History must hold at least one position.")
+        self.capacity = history
+        self.smoothing = smoothing
+        self.alpha = alpha
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.max_speed = max_velocity_kmph / 3.6
+        self.tracks = {}
+        self.rejected = 0  # Reports ignored as glitches or out of order
+        self.version = 0  # Incremented whenever the motion of any tag changes
+
+    def update(self, tag_id, x, y, z, timestamp):
+        """
+        Adds a position report for a tag.
+
+        :return: The tag's TagKinematics after the report, or None if the report was ignored.
+        """
+        track = self.tracks.get(tag_id)
+        if track is None:
+            track = self.tracks[tag_id] = _Track(self.capacity)
+        elif not timestamp > track.timestamp:
+            self.rejected += 1
+            return None
+        else:
+            dt = timestamp - track.timestamp
+            raw_vx, raw_vy = (x - track.x) / dt, (y - track.y) / dt
+            raw_speed = math.sqrt(raw_vx ** 2 + raw_vy ** 2 + ((z - track.z) / dt) ** 2)
+            if raw_speed > self.max_speed:
+                self.rejected += 1
+                return None
+
+            if self.smoothing == 'kalman':
+                vx, vy = self._kalman_update(track, x, y, dt)
+            elif self.smoothing == 'ema' and track.count > 1:
+                vx = self.alpha * raw_vx + (1 - self.alpha) * track.vx
+                vy = self.alpha * raw_vy + (1 - self.alpha) * track.vy
+            else:
+                vx, vy = raw_vx, raw_vy
+
+            speed = math.hypot(vx, vy)
+            track.acceleration = (speed - track.speed) / dt if track.count > 1 else 0.0
+            track.vx, track.vy, track.speed = vx, vy, speed
+            if speed >= STATIONARY_SPEED:
+                track.heading = math.degrees(math.atan2(vy, vx))
+
+        if self.smoothing == 'kalman' and track.kalman is None:
+            # Start the filter at the first position, at rest with an uncertain velocity
+            track.kalman = [[x, 0.0, self.measurement_noise, 0.0, self.max_speed ** 2],
+                            [y, 0.0, self.measurement_noise, 0.0, self.max_speed ** 2]]
+
+        track.history[track.head] = (timestamp, x, y, z)
+        track.head = (track.head + 1) % self.capacity
+        track.count += 1
+        track.timestamp, track.x, track.y, track.z = timestamp, x, y, z
+        self.version += 1
+        return self._kinematics(track)
+
+    def _kalman_update(self, track, x, y, dt):
+        # Predict and correct a constant-velocity model on each axis independently
+        q, r = self.process_noise, self.measurement_noise
+        velocities = []
+        for state, measured in zip(track.kalman, (x, y)):
+            p, v, p00, p01, p11 = state
+            # Predict
+            p += v * dt
+            p00 += dt * (2 * p01 + dt * p11) + q * dt ** 4 / 4
+            p01 += dt * p11 + q * dt ** 3 / 2
+            p11 += q * dt ** 2
+            # Correct with the measured position
+            s = p00 + r
+            k0, k1 = p00 / s, p01 / s
+            residual = measured - p
+            p += k0 * residual
+            v += k1 * residual
+            p00, p01, p11 = (1 - k0) * p00, (1 - k0) * p01, p11 - k1 * p01
+            state[:] = (p, v, p00, p01, p11)
+            velocities.append(v)
+        return velocities
+
+    def _kinematics(self, track):
+        return TagKinematics(track.timestamp, track.x, track.y, track.z, track.vx, track.vy, track.speed,
+                             track.heading, track.acceleration)
+
+    def update_row(self, row):
+        """Adds a row in the getCoordinateData layout (with float X, Y, Z). Rows that are not numeric are ignored."""
+        try:
+            return self.update(row[1], float(row[2]), float(row[3]), float(row[4]), float(row[6]))
+        except (ValueError, IndexError):
+            return None
+
+    def update_table(self, table):
+        """Adds every valid record of a CoordinateTable, in order."""
+        records = table.records[table.valid_mask()]
+        for code, x, y, z, timestamp in zip(records['tag'].tolist(), records['x'].tolist(), records['y'].tolist(),
+                                            records['z'].tolist(), records['timestamp'].tolist()):
+            self.update(table.tags.value(code), x, y, z, timestamp)
+
+    def get(self, tag_id):
+        """Returns the current TagKinematics of a tag, or None if it has not been seen."""
+        track = self.tracks.get(tag_id)
+        return self._kinematics(track) if track is not None else None
+
+    def snapshot(self):
+        """Returns a KinematicsSnapshot of the current motion of every tag."""
+        snapshot = KinematicsSnapshot((tag_id, self._kinematics(track)) for tag_id, track in self.tracks.items())
+        snapshot.version = self.version
+        return snapshot
+
+    def speed(self, tag_id):
+        """Returns the current speed of a tag in m/s, or None if it has not been seen."""
+        track = self.tracks.get(tag_id)
+        return track.speed if track is not None else None
+
+    def speed_kmph(self, tag_id):
+        speed = self.speed(tag_id)
+        return speed * 3.6 if speed is not None else None
+
+    def history(self, tag_id):
+        """Returns the recent (timestamp, x, y, z) positions of a tag, oldest first, as an (N, 4) array."""
+        track = self.tracks.get(tag_id)
+        if track is None:
+            return np.empty((0, 4))
+        if track.count < self.capacity:
+            return track.history[:track.count].copy()
+        return np.roll(track.history, -track.head, axis=0)
+
+    def remove(self, tag_id):
+        if self.tracks.pop(tag_id, None) is not None:
+            self.version += 1
+
+    def clear(self):
+        self.tracks.clear()
+        self.version += 1
+
+    def __contains__(self, tag_id):
+        return tag_id in self.tracks
+
+    def __len__(self):
+        return len(self.tracks)
@@ -6,17 +6,25 @@ import os
 
 # Define the video parameters
 output_file = "output_video.mp4"
-if os.path.exists(output_file):
-    os.remove(output_file)  # Delete the existing video file
 
 
 codec = 'mp4v'  # Codec, e.g., 'mp4v' or 'XVID'
 fps = 30        # Frames per second
 frame_size = (640, 480)  # Example frame size, should match plot size
 
-# Initialize VideoWriterState
-video_writer_state = VideoWriterState(output_file, codec, fps, frame_size)
-video_writer_state.initialize_writer()  # Initialize the writer before use
+
+def create_video_writer_state():
+    """
+    Replaces output_file with a new, empty video and returns its VideoWriterState, with frames
+    encoded on a background thread so rendering never waits for the encoder.
+    """
+    if os.path.exists(output_file):
+        os.remove(output_file)  # Delete the existing video file
+
+    video_writer_state = VideoWriterState(output_file, codec, fps, frame_size)
+    video_writer_state.initialize_writer()  # Initialize the writer before use
+    video_writer_state.start_encoder()
+    return video_writer_state
 
 
 def check_dependencies():
@@ -27,7 +35,7 @@ def check_dependencies():
     import sys
     import subprocess
 
-    required_modules = ['csv', 'matplotlib']  # List all required modules here
+    required_modules = ['csv', 'matplotlib', 'numpy']  # List all required modules here
 
     for module in required_modules:
         try:
@@ -204,18 +212,37 @@ def stretchData(coordinateData, previous_range, new_range):
 
     return stretchedCoordinateData
 
-def main():
+def main(offline=False, processes=1, pipelined=False, render_fps=None):
+    """
+    Replays the selected dataset, rendering it to output_video.mp4 and running the alarm checks.
+
+    Args:
+    offline (bool): Render in log time instead of in real time. Frames are stepped at exactly
+                    1/fps of log time and each is written once, so the replay runs as fast as it
+                    can be rendered and the video is the same on every run. Settings changed by
+                    the web application are not picked up during an offline render.
+    processes (int): Number of processes to render an offline replay with (see parallel_render.py).
+                     The video is the same as with a single process.
+    pipelined (bool): Run a real-time replay as a pipeline of stages on separate threads (see pipeline.py),
+                      so the alarm checks never wait for a frame to be drawn. Ignored when offline.
+    render_fps (float): Rate a pipelined replay draws frames at, independent of the rate the data arrives at.
+                        Defaults to the frame rate of the video.
+    """
     # Check for dependencies
     check_dependencies()
 
     # Import the required function after checking dependencies
-    from coordinate_extractor import getCoordinateData
-    from plot_coordinates import plot_coordinates
+    from calibration import SITE_RANGE, getColumnBounds, getDatasetCalibration
+    from replay_cache import getNormalizedTable
+    from plot_coordinates import CoordinatePlotter
+    from video_maker import add_frame
     from datetime import datetime
     import time
     from tag import Tag
-    from tag_manager import TagManager
+    from tag_manager import TagManager, getSnapshotSequenceData
     from velocity import exportVelocity
+    from replay_window import ReplayWindow, VirtualClock
+    from kinematics import KinematicsTracker
     import os
 
     # Load the sequence data from the JSON file
@@ -226,10 +253,14 @@ def main():
     selected_data_set = "Dataset 6"  # You can dynamically select this based on user input or logic
     selected_sequence = "Steelmaking Sequence"  # Example sequence name
 
+    # Add current JSON data. A pipelined replay writes it from its persistence stage instead of a timer.
+    tag_manager = TagManager('data.json', auto_flush=not (pipelined and not offline))
+
     # Update settings if needed
     tag_manager.update_settings(selected_data_set="Dataset 2", selected_sequence="Steelmaking Sequence")
 
     dataset_path, quadrilaterals, colour = get_sequence_data(sequence_data, selected_sequence, selected_data_set)
+    dataset_calibration = getDatasetCalibration(sequence_data, selected_data_set)
 
     
     
@@ -239,11 +270,10 @@ def main():
     # Call the function to get the coordinate data
     print(log_file_path)
 
-    # Add current JSON data
-    tag_manager = TagManager('data.json')
-
-    # Initialize the Alarm Manager
-    alarm_manager = AlarmManager(tag_manager)
+    # Initialize the Alarm Manager, with the current motion of every tag tracked from the incoming reports.
+    # Each tick only re-evaluates the checks affected by the tags that moved.
+    kinematics = KinematicsTracker()
+    alarm_manager = AlarmManager(tag_manager, kinematics=kinematics, incremental=True)
     
     
     
@@ -254,13 +284,11 @@ def main():
     selected_sequence = tag_manager.data['settings'].get('selected_sequence', 'Default Sequence')
     print(f"Loaded settings: DataSet - {selected_data_set}, Sequence - {selected_sequence}")
 
-    coordinate_data = getCoordinateData(log_file_path)
-    
-    previous_range = getCoordinateBounds(coordinate_data)
+    new_range = SITE_RANGE
     
-    new_range = 0.00,74.25,0.00,34.20,0.50,7.15
-    
-    coordinate_data = stretchData(coordinate_data,previous_range,new_range)
+    # Parse the log into typed columns rescaled onto the site, using the dataset's stored calibration if it
+    # has one, otherwise scanning the data for its bounds. Later runs memory-map the cached result.
+    coordinate_data, previous_range = getNormalizedTable(log_file_path, new_range, dataset_calibration)
     
     csv_output_path = os.path.join(os.getcwd(), "velocity_dataset_5.csv")
     exportVelocity(coordinate_data, csv_output_path)
@@ -275,7 +303,7 @@ def main():
     zLow = 0.75
     zHigh = 1.50
     """
-    xLow, xHigh, yLow, yHigh, zLow, zHigh = getCoordinateBounds(coordinate_data)
+    xLow, xHigh, yLow, yHigh, zLow, zHigh = getColumnBounds(coordinate_data)
     print(xLow, xHigh, yLow, yHigh, zLow, zHigh)
     
     #print(coordinate_data)
@@ -308,47 +336,202 @@ def main():
     
     
     # Beginning of the actual plotting:
+    # The window keeps the rows of the last 1.5 seconds (in log time) and drops older ones
+    window = ReplayWindow(coordinate_data, max_age=1.5)
     initial_time = time.time()
     print(initial_time)
-    initial_coordinate_time = float(coordinate_data[0][6])
+    initial_coordinate_time = window.first_timestamp()
     print(initial_coordinate_time)
     time_offset = initial_time - initial_coordinate_time
 
-    # Plot the coordinates with the defined bounds
-    while (len(coordinate_data) > 4):
-        current_time = time.time()
-        time_diff = current_time - initial_time
-        coordinate_time_diff = float(coordinate_data[0][6]) - initial_coordinate_time
-        while ((time_diff-coordinate_time_diff) > 1.5):
-            remove_row_by_index(coordinate_data, 0) # Remove the first row of coordinate data
-            #print("Removed row")
-            if (len(coordinate_data) > 0):
-                coordinate_time_diff = float(coordinate_data[0][6]) - initial_coordinate_time
+    # The figure, background and geofences are created once and reused for every frame
+    video_writer_state = create_video_writer_state()
+    plotter = CoordinatePlotter(xLow, xHigh, yLow, yHigh, zLow, zHigh, tag_manager, sequence_data=sequence_data, toggle_names=True,
+                                frame_size=video_writer_state.frame_size)
+
+    if offline and processes > 1:
+        # Render segments of the replay in parallel; the alarm checks run in this process
+        from parallel_render import render_parallel
+        render_parallel(window.data, plotter, alarm_manager, sequence_data, video_writer_state,
+                        initial_coordinate_time, processes, max_age=window.max_age)
+    elif pipelined and not offline:
+        # Ingest, tag state, alarm checks, rendering and persistence each run on their own thread
+        from pipeline import ReplayPipeline, replay_ticks
+        pipeline = ReplayPipeline(tag_manager, alarm_manager, plotter, video_writer_state, sequence_data,
+                                  initial_coordinate_time, kinematics=kinematics, fps=render_fps)
+        pipeline.run(replay_ticks(window, initial_time, initial_coordinate_time))
+        pipeline.print_stats()
+    else:
+        # Offline, frames follow a virtual clock and alerts are stamped with log time
+        clock = VirtualClock(initial_coordinate_time, video_writer_state.fps) if offline else None
+        if clock is not None:
+            alarm_manager.clock = clock.time
+
+        # Plot the coordinates with the defined bounds
+        while (window.remaining() > 4):
+            if clock is not None:
+                current_coordinate_time = clock.time()
             else:
-                break
-        # Plot a single plot with the updated coordinate data
-        plot_coordinates(coordinate_data, xLow, xHigh, yLow, yHigh, zLow, zHigh, initial_time, initial_coordinate_time, toggle_names=True, video_writer_state=video_writer_state)
-
-        # Reupdate sequence and tag information within main.py
-        data_json_path = os.path.join(os.getcwd(), "data.json")
-        sequence_json_path = os.path.join(os.getcwd(), "sequence_data.json")
-
-        sequence_name, tags, cranes, geofence_zones = getFullSequenceData(data_json_path, sequence_json_path)
+                current_time = time.time()
+                time_diff = current_time - initial_time
+                current_coordinate_time = initial_coordinate_time + time_diff
+            window.advance(current_coordinate_time)
+            new_rows = window.new_rows(current_coordinate_time)
+            kinematics.update_table(new_rows)
+
+            # Plot a single frame with the rows of the window that are due by now and add it to the video
+            frame_data = window.frame(current_coordinate_time)
+            plotter.render(frame_data, current_coordinate_time, initial_coordinate_time, new_rows=new_rows)
+            add_frame(plotter.capture_frame(), video_writer_state, num_repeats=1 if clock is not None else None)
+
+            if clock is not None:
+                clock.tick()
+            else:
+                # Reupdate sequence and tag information from memory, picking up any settings changed by the web application
+                tag_manager.reload_if_changed()
+            sequence_name, tags, cranes, geofence_zones = getSnapshotSequenceData(tag_manager.snapshot(), sequence_data)
 
-        # Run the alarm checks based on the sequence
-        alarm_manager.run_alarm_checks(sequence_name, tags, cranes, geofence_zones)
+            # Run the alarm checks based on the sequence
+            alarm_manager.run_alarm_checks(sequence_name, tags, cranes, geofence_zones)
 
-        #print(f"Sequence Name: {sequence_name}")
-        #print(f"Tags: {tags}")
-        #print(f"Cranes: {cranes}")
-        #print(f"Geofence Zones: {geofence_zones}")
+            #print(f"Sequence Name: {sequence_name}")
+            #print(f"Tags: {tags}")
+            #print(f"Cranes: {cranes}")
+            #print(f"Geofence Zones: {geofence_zones}")
 
-        #input("Press Enter to continue...")
-        #break
+            #input("Press Enter to continue...")
+            #break
 
-    # Release the video writer once the plotting is complete
+    # Release the video writer and write any pending tag changes once the plotting is complete
+    plotter.close()
     release_video_writer(video_writer_state)
+    tag_manager.flush()
     print ("Run complete\n")    
 
+def live_main(host, port=None, duration=None, calibration=None):
+    """
+    Runs the visualisation and alarm checks on coordinates streamed live from a positioning
+    server instead of replaying a log file.
+
+    Args:
+    host (str): Host name or IP address of the positioning server.
+    port (int): TCP port of the positioning server. Defaults to the PEKIO port.
+    duration (float): Optional number of seconds to run for. Runs until interrupted if not given.
+    calibration (OnlineCalibration): Transform onto the site. Defaults to the selected dataset's stored calibration.
+    """
+    import asyncio
+    import time
+    from collections import deque
+    from pekio_client import PekioClient, PEKIO_PORT
+    from calibration import OnlineCalibration
+    from kinematics import KinematicsTracker
+    from plot_coordinates import CoordinatePlotter
+    from video_maker import add_frame
+    from tag_manager import TagManager, getSnapshotSequenceData
+
+    tag_manager = TagManager('data.json')
+    kinematics = KinematicsTracker()
+    alarm_manager = AlarmManager(tag_manager, kinematics=kinematics, incremental=True)
+    sequence_json_path = os.path.join(os.getcwd(), "sequence_data.json")
+    sequence_data = load_json_data(sequence_json_path)
+
+    def report_out_of_range(tag_id, x, y, z):
+        if calibration.out_of_range == 1 or calibration.out_of_range % 100 == 0:
+            print(f"Tag {tag_id} at ({x}, {y}, {z}) is outside the calibrated extents ({calibration.out_of_range} so far)")
+
+    # Rescale onto the site with the selected dataset's stored calibration, or with running bounds if it has none
+    if calibration is None:
+        selected_data_set = tag_manager.data['settings'].get('selected_data_set', 'Default Dataset')
+        calibration = OnlineCalibration.from_sequence_data(sequence_data, selected_data_set)
+    if calibration.on_out_of_range is None:
+        calibration.on_out_of_range = report_out_of_range
+    xLow, xHigh, yLow, yHigh, zLow, zHigh = calibration.new_range
+
+    def calibrate(row):
+        # Only rows with a numeric timestamp of a registered tag can be plotted
+        try:
+            float(row[6])
+        except ValueError:
+            return None
+        if tag_manager.get_tag_type(row[1]) is None:
+            return None
+        return calibration.apply_row(row)
+
+    video_writer_state = create_video_writer_state()
+    plotter = CoordinatePlotter(xLow, xHigh, yLow, yHigh, zLow, zHigh, tag_manager, sequence_data=sequence_data, toggle_names=True,
+                                frame_size=video_writer_state.frame_size)
+
+    def process_frame(coordinate_data, new_rows, initial_time, initial_coordinate_time):
+        coordinate_time = initial_coordinate_time + (time.time() - initial_time)
+        plotter.render(coordinate_data, coordinate_time, initial_coordinate_time, new_rows=new_rows)
+        add_frame(plotter.capture_frame(), video_writer_state)
+        tag_manager.reload_if_changed()
+        sequence_name, tags, cranes, geofence_zones = getSnapshotSequenceData(tag_manager.snapshot(), sequence_data)
+        alarm_manager.run_alarm_checks(sequence_name, tags, cranes, geofence_zones)
+
+    async def run():
+        client = PekioClient(host, port if port is not None else PEKIO_PORT)
+        client_task = asyncio.create_task(client.run())
+        coordinate_data = deque()
+        new_rows = []  # Rows received since the previous frame, in order of arrival
+        initial_time = initial_coordinate_time = None
+        end_time = time.time() + duration if duration is not None else None
+
+        try:
+            while end_time is None or time.time() < end_time:
+                try:
+                    row = await asyncio.wait_for(client.queue.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+
+                # Take everything that arrived while the previous frame was rendering
+                for row in [row] + client.drain():
+                    row = calibrate(row)
+                    if row is not None:
+                        coordinate_data.append(row)
+                        new_rows.append(row)
+                        kinematics.update_row(row)
+                if not coordinate_data:
+                    continue
+
+                if initial_time is None:
+                    initial_time = time.time()
+                    initial_coordinate_time = float(coordinate_data[0][6])
+
+                # Drop rows that are more than 1.5 seconds old
+                time_diff = time.time() - initial_time
+                while coordinate_data and (time_diff - (float(coordinate_data[0][6]) - initial_coordinate_time)) > 1.5:
+                    coordinate_data.popleft()
+
+                # Render on a worker thread so the client keeps reading into its queue
+                await asyncio.to_thread(process_frame, list(coordinate_data), new_rows, initial_time,
+                                        initial_coordinate_time)
+                new_rows = []
+        finally:
+            client.stop()
+            client_task.cancel()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        plotter.close()
+        release_video_writer(video_writer_state)
+        tag_manager.flush()
+    print("Live run complete\n")
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay the selected dataset into output_video.mp4 and run the alarm checks.")
+    parser.add_argument('--offline', action='store_true',
+                        help="Render in log time as fast as possible instead of in real time.")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Number of processes for an offline render (implies --offline).")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Run the real-time replay as a pipeline of threads, so alarms never wait for rendering.")
+    parser.add_argument('--render-fps', type=float, default=None,
+                        help="Frames per second to draw in a --pipeline replay. Defaults to the video frame rate.")
+    args = parser.parse_args()
+    main(offline=args.offline or args.processes > 1, processes=args.processes, pipelined=args.pipeline,
+         render_fps=args.render_fps)
\ No newline at end of file
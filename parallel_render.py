@@ -0,0 +1,199 @@
+import copy
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from alarms import AlarmManager
+from plot_coordinates import CoordinatePlotter
+from replay_window import ReplayWindow, VirtualClock
+from tag_manager import TagManager, getSnapshotSequenceData
+from video_maker import VideoWriterState, add_frame
+
+# Segments are written losslessly, so the final video is only encoded once
+SEGMENT_CODEC = 'FFV1'
+SEGMENT_EXTENSION = '.avi'
+
+
+def count_frames(coordinate_data, clock, max_age=1.5):
+    """
+    Returns the number of frames the offline replay loop in main.py renders: it draws frames at
+    the clock's frame times until 4 or fewer rows are left in the window.
+    """
+    window = ReplayWindow(coordinate_data, max_age)
+    frame_count = 0
+    while window.remaining() > 4:
+        window.advance(clock.frame_time(frame_count))
+        frame_count += 1
+    return frame_count
+
+
+def split_frames(frame_count, segments):
+    """Splits frames 0 .. frame_count - 1 into at most segments contiguous (start, stop) ranges of similar length."""
+    bounds = np.linspace(0, frame_count, max(1, min(segments, frame_count)) + 1).round().astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def render_parallel(coordinate_data, plotter, alarm_manager, sequence_data, video_writer_state,
+                    initial_coordinate_time, processes=None, max_age=1.5):
+    """
+    Renders an offline replay with several processes and writes it to video_writer_state.
+
+    The frames are split into one contiguous segment per process. Each segment is rendered by
+    its own CoordinatePlotter into a lossless temporary video, and the segments are then added
+    to video_writer_state in order, so the result is the same as rendering every frame in turn.
+
+    What a frame shows also depends on earlier frames (last known tag positions, active alarms
+    and the order artists were created in). This process therefore runs through the whole
+    replay without drawing, updating plotter, alarm_manager and its TagManager exactly as a
+    sequential render would, and hands each worker the state at the start of its segment.
+
+    Args:
+    coordinate_data (CoordinateTable or list): The normalised rows of the replay.
+    plotter (CoordinatePlotter): The plotter set up for the replay. It is only used to track state.
+    alarm_manager (AlarmManager): Runs the alarm checks; its clock is set to the replay's virtual clock.
+    sequence_data (dict): Contents of sequence_data.json.
+    video_writer_state (VideoWriterState): The initialized writer of the final video.
+    initial_coordinate_time (float): Log time of the first frame.
+    processes (int): Number of worker processes. Defaults to the number of CPUs.
+    max_age (float): Rows older than this many seconds are dropped from the window, as in main.py.
+
+    Returns:
+    int: The number of frames rendered.
+    """
+    processes = processes or os.cpu_count() or 1
+    clock = VirtualClock(initial_coordinate_time, video_writer_state.fps)
+    alarm_manager.clock = clock.time
+    tag_manager = alarm_manager.tag_manager
+
+    window = ReplayWindow(coordinate_data, max_age)
+    frame_count = count_frames(window.data, clock, max_age)
+    segments = split_frames(frame_count, processes)
+    segment_starts = {start: stop for start, stop in segments}
+    frame_size = tuple(video_writer_state.frame_size)
+
+    segment_dir = tempfile.mkdtemp(prefix='segments_')
+    # Spawned workers start clean instead of inheriting this process's threads and figures
+    pool = ProcessPoolExecutor(max_workers=len(segments) or 1, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = []
+        for frame_index in range(frame_count):
+            if frame_index in segment_starts:
+                # Hand over the state left by the previous frame and let the worker take it from here
+                stop = segment_starts[frame_index]
+                segment_path = os.path.join(segment_dir, f"segment_{len(futures)}")
+                with tag_manager.lock:
+                    tag_manager.sync_tags()
+                    data = copy.deepcopy(tag_manager.data)
+                with open(segment_path + '.json', 'w') as file:
+                    json.dump(data, file)
+
+                # Only the rows that can appear in the segment's frames are sent
+                first = int(np.searchsorted(window.timestamps, clock.frame_time(frame_index) - max_age, side='left'))
+                last = int(np.searchsorted(window.timestamps, clock.frame_time(stop - 1), side='right'))
+                task = {
+                    'segment_path': segment_path,
+                    'frames': (frame_index, stop),
+                    'coordinate_data': window.data[first:last],
+                    'bounds': (plotter.xLow, plotter.xHigh, plotter.yLow, plotter.yHigh, plotter.zLow, plotter.zHigh),
+                    'toggle_names': plotter.toggle_names,
+                    'artist_order': plotter.artist_order(),
+                    'active_alarms': copy.deepcopy(alarm_manager.active_alarms),
+                    'kinematics': copy.deepcopy(alarm_manager.kinematics),
+                    'incremental': alarm_manager.incremental,
+                    'sequence_data': sequence_data,
+                    'initial_coordinate_time': initial_coordinate_time,
+                    'fps': video_writer_state.fps,
+                    'frame_size': frame_size,
+                    'max_age': max_age,
+                }
+                futures.append(((frame_index, stop), pool.submit(_render_segment, task)))
+
+            # Update the tags and alarms like the sequential render, without drawing
+            coordinate_time = clock.time()
+            window.advance(coordinate_time)
+            new_rows = window.new_rows(coordinate_time)
+            if alarm_manager.kinematics is not None:
+                alarm_manager.kinematics.update_table(new_rows)
+            plotter.render(window.frame(coordinate_time), coordinate_time, initial_coordinate_time, draw=False,
+                           new_rows=new_rows)
+            clock.tick()
+            sequence_name, tags, cranes, geofence_zones = getSnapshotSequenceData(tag_manager.snapshot(), sequence_data)
+            alarm_manager.run_alarm_checks(sequence_name, tags, cranes, geofence_zones)
+
+        # Concatenate the segments in order as they finish
+        for (start, stop), future in futures:
+            segment_path = future.result()
+            capture = cv2.VideoCapture(segment_path)
+            decoded = 0
+            try:
+                while True:
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    add_frame(frame, video_writer_state, num_repeats=1)
+                    decoded += 1
+            finally:
+                capture.release()
+            if decoded != stop - start:
+                raise RuntimeError(f"Segment {segment_path} decoded to {decoded} frames instead of {stop - start}.")
+    finally:
+        pool.shutdown(cancel_futures=True)
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+    return frame_count
+
+
+def _render_segment(task):
+    # Runs in a worker process: renders frames task['frames'] into a lossless video and returns its path
+    start, stop = task['frames']
+    tag_manager = TagManager(task['segment_path'] + '.json')
+    clock = VirtualClock(task['initial_coordinate_time'], task['fps'], frame_index=start)
+    # The parent's pass over every frame already reported the alarms
+    alarm_manager = AlarmManager(tag_manager, clock=clock.time, kinematics=task['kinematics'],
+                                 incremental=task['incremental'], report=False)
+    alarm_manager.active_alarms = task['active_alarms']
+
+    video_path = task['segment_path'] + SEGMENT_EXTENSION
+    video_writer_state = VideoWriterState(video_path, SEGMENT_CODEC, task['fps'], task['frame_size'])
+    video_writer_state.initialize_writer()
+    if not video_writer_state.video_writer.isOpened():
+        raise RuntimeError(f"Could not open {video_path} for writing with the {SEGMENT_CODEC} codec.")
+
+    plotter = CoordinatePlotter(*task['bounds'], tag_manager, sequence_data=task['sequence_data'],
+                                toggle_names=task['toggle_names'], frame_size=task['frame_size'])
+    plotter.restore_artist_order(task['artist_order'])
+    window = ReplayWindow(task['coordinate_data'], task['max_age'])
+    if start > 0:
+        # The rows up to the previous frame have already been given to the kinematics tracker
+        window.new_rows(clock.frame_time(start - 1))
+
+    try:
+        while clock.frame_index < stop:
+            coordinate_time = clock.time()
+            window.advance(coordinate_time)
+            new_rows = window.new_rows(coordinate_time)
+            if alarm_manager.kinematics is not None:
+                alarm_manager.kinematics.update_table(new_rows)
+            # The first frame builds the trail from the window, as the earlier rows were not sent
+            plotter.render(window.frame(coordinate_time), coordinate_time, task['initial_coordinate_time'],
+                           new_rows=new_rows if clock.frame_index > start else None)
+            add_frame(plotter.capture_frame(), video_writer_state, num_repeats=1)
+
+            # The alerts drawn in the next frame come from this frame's alarm checks, stamped with the
+            # next frame's time like the sequential render
+            clock.tick()
+            if clock.frame_index < stop:
+                sequence_name, tags, cranes, geofence_zones = getSnapshotSequenceData(tag_manager.snapshot(), task['sequence_data'])
+                alarm_manager.run_alarm_checks(sequence_name, tags, cranes, geofence_zones)
+    finally:
+        plotter.close()
+        video_writer_state.release()
+        tag_manager.flush()
+
+    return video_path
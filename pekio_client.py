@@ -0,0 +1,189 @@
+import asyncio
+import time
+
+from coordinate_extractor import parseCoordinateLine
+
+# Port the positioning server listens on (see data_extract.js)
+PEKIO_PORT = 25025
+
+# Command that subscribes the connection to coordinate reports
+REPORT_LIST_COMMAND = "$PEKIO,SET_REPORT_LIST,COORD\r\n"
+
+
+class PekioClient:
+    """
+    Connects to a PEKIO positioning server over TCP and turns its $PEKIO,COORD reports into
+    rows in the getCoordinateData layout.
+
+    Parsed rows are put on a bounded asyncio queue. When the consumers fall behind, the queue
+    fills up, the client stops reading from the socket and TCP flow control pushes back on the
+    server instead of letting memory grow. Lost connections are retried with exponential backoff.
+    """
+    def __init__(self, host, port=PEKIO_PORT, queue_size=1024, reconnect_delay=1.0, max_reconnect_delay=30.0):
+        """
+        :param host: Host name or IP address of the positioning server.
+        :param port: TCP port of the positioning server.
+        :param queue_size: Maximum number of parsed rows waiting for a consumer.
+        :param reconnect_delay: Initial delay in seconds before reconnecting after a failure.
+        :param max_reconnect_delay: Upper limit for the reconnection delay.
+        """
+        self.host = host
+        self.port = port
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = asyncio.Event()
+        self.connections = 0
+        self.records_received = 0
+        self.lines_skipped = 0  # Lines longer than the reader's buffer limit
+        self._running = False
+
+    async def run(self):
+        """
+        Connects, subscribes to coordinate reports and reads until stop() is called,
+        reconnecting whenever the connection fails or is closed by the server.
+        """
+        self._running = True
+        delay = self.reconnect_delay
+        while self._running:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                print(f"Failed to connect to {self.host}:{self.port}: {e}")
+            else:
+                self.connections += 1
+                delay = self.reconnect_delay
+                try:
+                    await self._stream(reader, writer)
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    print(f"Connection to {self.host}:{self.port} lost: {e}")
+                finally:
+                    self.connected.clear()
+                    writer.close()
+
+            if self._running:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _stream(self, reader, writer):
+        writer.write(REPORT_LIST_COMMAND.encode('ascii'))
+        await writer.drain()
+        self.connected.set()
+
+        while self._running:
+            line = await self._read_line(reader)
+            if not line:
+                return  # Server closed the connection
+            row = parseCoordinateLine(line.decode('utf-8', errors='replace'))
+            if row is not None:
+                # Blocks while the queue is full, which stops us reading from the socket
+                await self.queue.put(row)
+                self.records_received += 1
+
+    async def _read_line(self, reader):
+        """
+        Reads the next line like reader.readline(), but skips lines longer than the reader's
+        buffer limit instead of raising, so one corrupt line does not end the stream.
+        Returns b'' once the server has closed the connection.
+        """
+        skipping = False
+        while True:
+            try:
+                line = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                return b'' if skipping else e.partial
+            except asyncio.LimitOverrunError as e:
+                # Discard the start of the line and keep reading until its end
+                await reader.readexactly(e.consumed)
+                skipping = True
+                continue
+            if not skipping:
+                return line
+            skipping = False
+            self.lines_skipped += 1
+            print(f"Skipped an over-long line from {self.host}:{self.port}")
+
+    def stop(self):
+        """Stops the client after the current read completes."""
+        self._running = False
+
+    async def records(self):
+        """Asynchronously yields parsed rows as they arrive."""
+        while True:
+            yield await self.queue.get()
+
+    def drain(self):
+        """Returns every row that is currently queued without waiting for more."""
+        rows = []
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return rows
+
+
+class PekioReplayServer:
+    """
+    Local stand-in for the positioning server that replays a recorded log file.
+
+    After a client sends $PEKIO,SET_REPORT_LIST,COORD the server answers $PEKIO,OK and streams
+    the $PEKIO,COORD lines of the log, paced by their calculation timestamps. A speed of 1.0
+    replays in real time, 10.0 ten times faster, and None as fast as the client can read.
+    """
+    def __init__(self, log_file_path, host='127.0.0.1', port=0, speed=1.0):
+        self.log_file_path = log_file_path
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.server = None
+
+    async def start(self):
+        """Starts listening and returns the port in use (useful when port=0)."""
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                command = await reader.readline()
+                if not command:
+                    return
+                if command.strip() == REPORT_LIST_COMMAND.strip().encode('ascii'):
+                    writer.write(b"$PEKIO,OK\r\n")
+                    await writer.drain()
+                    break
+
+            first_timestamp = None
+            start_time = time.monotonic()
+            with open(self.log_file_path, 'r') as file:
+                for line in file:
+                    line = line.strip()
+                    if not line.startswith('$PEKIO,COORD'):
+                        continue
+
+                    if self.speed:
+                        try:
+                            timestamp = float(line.rsplit(',', 1)[1])
+                        except ValueError:
+                            timestamp = None
+                        if timestamp is not None:
+                            if first_timestamp is None:
+                                first_timestamp = timestamp
+                            delay = (timestamp - first_timestamp) / self.speed - (time.monotonic() - start_time)
+                            if delay > 0:
+                                await asyncio.sleep(delay)
+
+                    writer.write((line + "\r\n").encode('utf-8'))
+                    # Wait for the client when it applies backpressure
+                    await writer.drain()
+        except (ConnectionResetError, BrokenPipeError, asyncio.CancelledError):
+            pass  # Client went away or the server is shutting down
+        finally:
+            writer.close()
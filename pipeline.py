@@ -0,0 +1,373 @@
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from tag_manager import getSnapshotSequenceData
+from video_maker import add_frame
+
+# What the ingest stage hands downstream for one tick: when it was read (time.monotonic()), the log time
+# it represents, the rows that arrived since the previous tick and the rows to draw for it
+Tick = namedtuple('Tick', ['created', 'coordinate_time', 'new_rows', 'frame_rows'])
+
+# What the state stage hands to the alarm stage: the tick's creation time and immutable snapshots of the
+# TagManager data and (if tracked) the kinematics of every tag
+StateSnapshot = namedtuple('StateSnapshot', ['created', 'tags', 'kinematics'])
+
+# 'block' makes a full queue hold up the stage feeding it; 'latest' drops the oldest queued item instead,
+# for stages that only need the most recent state
+STAGE_OVERFLOW = ('block', 'latest')
+
+_STOP = object()
+
+
+class Stage:
+    """
+    A pipeline stage: a worker thread that calls handler on each item of a bounded queue.
+
+    Every stage counts the items it received, processed and dropped, the time spent in handler
+    and the latency from when each item was read by the ingest stage to when it was handled.
+    """
+    def __init__(self, name, handler, queue_size=8, overflow='block'):
+        """
+        :param name: Name shown in the statistics.
+        :param handler: Called with each item on the stage's thread. Exceptions are counted and printed.
+        :param queue_size: Number of items that can wait for the stage.
+        :param overflow: What happens when the queue is full, see STAGE_OVERFLOW.
+        """
+        if overflow not in STAGE_OVERFLOW:
+            raise ValueError(f"Invalid overflow: {overflow}. Choose from {list(STAGE_OVERFLOW)}.")
+        self.name = name
+        self.handler = handler
+        self.overflow = overflow
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.started = None
+        self.stopped = None
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self):
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        """Queues an item for the stage, waiting for space or dropping the oldest item as set by overflow."""
+        self.received += 1
+        if self.overflow == 'block':
+            self.queue.put(item)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            start = time.perf_counter()
+            try:
+                self.handler(item)
+            except Exception as e:
+                self.errors += 1
+                print(f"{self.name} stage failed: {e!r}")
+            self.busy_time += time.perf_counter() - start
+            self.processed += 1
+            created = getattr(item, 'created', None)
+            if created is not None:
+                latency = time.monotonic() - created
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+        self.stopped = time.monotonic()
+
+    def close(self):
+        """Lets the stage finish the items already queued and waits for its thread to exit."""
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.thread = None
+
+    def stats(self):
+        """Returns the stage's counters, with its throughput in items per second of running time."""
+        end = self.stopped if self.stopped is not None else time.monotonic()
+        elapsed = end - self.started if self.started is not None else 0.0
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'queued': self.queue.qsize(),
+            'throughput': self.processed / elapsed if elapsed > 0 else 0.0,
+            'busy': self.busy_time / elapsed if elapsed > 0 else 0.0,
+            'mean_latency': self.total_latency / self.processed if self.processed else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+
+class RenderScheduler(Stage):
+    """
+    A stage that draws frames at a fixed rate, each from the most recent state put to it.
+
+    States that arrive between two frames are coalesced: only the newest is drawn and the others
+    are counted as dropped, so the frame rate does not depend on how fast the data arrives and
+    the time spent drawing always goes to the newest data rather than to a backlog. When no new
+    state has arrived by a frame's deadline nothing is drawn and the previous frame is held for
+    longer in the video. A frame that takes longer than its period to draw moves the next
+    deadline back instead of causing a burst of frames to catch up.
+    """
+    def __init__(self, name, handler, fps):
+        """
+        :param name: Name shown in the statistics.
+        :param handler: Called with the newest state on the scheduler's thread to draw a frame.
+        :param fps: Target number of frames per second.
+        """
+        if not fps > 0:
+            raise ValueError("The frame rate must be positive.")
+        super().__init__(name, handler, queue_size=1, overflow='latest')
+        self.fps = fps
+        self.pending = None
+        self.pending_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.late = 0  # Frames that missed their deadline
+        self.idle = 0  # Deadlines with no new state to draw
+
+    def start(self):
+        self.stop_event.clear()
+        super().start()
+
+    def put(self, item):
+        """Makes item the state drawn at the next frame, replacing any state that has not been drawn yet."""
+        with self.pending_lock:
+            self.received += 1
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = item
+
+    def _run(self):
+        period = 1 / self.fps
+        next_frame = time.monotonic()
+        while True:
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                self.stop_event.wait(delay)
+            stopping = self.stop_event.is_set()
+            with self.pending_lock:
+                item, self.pending = self.pending, None
+
+            if item is None:
+                self.idle += 1
+            else:
+                start = time.perf_counter()
+                try:
+                    self.handler(item)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"{self.name} stage failed: {e!r}")
+                self.busy_time += time.perf_counter() - start
+                self.processed += 1
+                created = getattr(item, 'created', None)
+                if created is not None:
+                    latency = time.monotonic() - created
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+            if stopping:
+                break
+
+            next_frame += period
+            now = time.monotonic()
+            if next_frame < now:
+                self.late += 1
+                next_frame = now
+        self.stopped = time.monotonic()
+
+    def close(self):
+        """Draws the last state put to the scheduler, if it has not been drawn, and waits for its thread to exit."""
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def stats(self):
+        stats = super().stats()
+        stats['late'] = self.late
+        stats['idle'] = self.idle
+        return stats
+
+
+def replay_ticks(window, initial_time, initial_coordinate_time, tick_interval=0.02, clock=time.time):
+    """
+    Yields a Tick for a ReplayWindow every tick_interval seconds of real time, following the log
+    in real time like the replay loop in main.py, until 4 or fewer rows are left in the window.
+    """
+    next_tick = clock()
+    while window.remaining() > 4:
+        coordinate_time = initial_coordinate_time + (clock() - initial_time)
+        window.advance(coordinate_time)
+        yield Tick(time.monotonic(), coordinate_time, window.new_rows(coordinate_time), window.frame(coordinate_time))
+
+        next_tick += tick_interval
+        delay = next_tick - clock()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_tick = clock()  # Behind: don't try to catch up with a burst of ticks
+
+
+class ReplayPipeline:
+    """
+    Runs the replay as a pipeline of stages on their own threads, joined by bounded queues:
+
+    ingest -> state -> alarms
+                    -> render (drawing and encoding the frame)
+                    -> persistence (writing data.json and picking up settings from the web application)
+
+    The state stage owns the tag state: it feeds the kinematics tracker and registers the latest
+    position of every tag that reported in the tick. Each downstream stage then works from an
+    immutable snapshot, so a slow frame or a slow write never delays the alarm checks; their
+    latency only depends on the checks themselves. The render and persistence stages only need
+    the most recent state, so they skip ticks they cannot keep up with: frames are drawn by a
+    RenderScheduler at their own rate from the newest tick, whatever rate the ticks arrive at.
+    """
+    def __init__(self, tag_manager, alarm_manager, plotter, video_writer_state, sequence_data, initial_coordinate_time,
+                 kinematics=None, queue_size=8, persistence_interval=0.25, fps=None):
+        """
+        :param tag_manager: TagManager holding the tags and alerts, constructed with auto_flush=False so
+                            that the persistence stage owns the writes of data.json.
+        :param alarm_manager: AlarmManager to run the checks with.
+        :param plotter: CoordinatePlotter to draw the frames with. The pipeline takes over its tag updates.
+        :param video_writer_state: Initialized VideoWriterState the frames are added to.
+        :param sequence_data: Contents of sequence_data.json.
+        :param initial_coordinate_time: Log time of the first frame.
+        :param kinematics: Optional KinematicsTracker fed with every new row.
+        :param queue_size: Number of ticks that can wait for the state and alarm stages.
+        :param persistence_interval: Minimum seconds between writes of data.json by the persistence stage.
+        :param fps: Rate to draw frames at. Defaults to the frame rate of the video.
+        """
+        if tag_manager.auto_flush:
+            raise ValueError("The pipeline's TagManager must be constructed with auto_flush=False")
+        self.tag_manager = tag_manager
+        self.alarm_manager = alarm_manager
+        self.plotter = plotter
+        self.video_writer_state = video_writer_state
+        self.sequence_data = sequence_data
+        self.initial_coordinate_time = initial_coordinate_time
+        self.kinematics = kinematics
+        self.persistence_interval = persistence_interval
+        self.last_persisted = 0.0
+        plotter.update_tags = False
+        # Rows for the fading trail that arrived since the last frame; the render stage skips ticks, not rows
+        self.trail_rows = []
+        self.trail_lock = threading.Lock()
+
+        self.ingested = 0
+        self.ingest_started = self.ingest_stopped = None
+        self.state_stage = Stage('state', self._update_state, queue_size)
+        self.alarm_stage = Stage('alarms', self._check_alarms, queue_size)
+        self.render_stage = RenderScheduler('render', self._render, fps or video_writer_state.fps)
+        self.persistence_stage = Stage('persistence', self._persist, 1, overflow='latest')
+        self.stages = [self.state_stage, self.alarm_stage, self.render_stage, self.persistence_stage]
+
+    def _update_state(self, tick):
+        rows = tick.new_rows
+        if len(rows):
+            if self.kinematics is not None:
+                self.kinematics.update_table(rows)
+
+            # Register the latest position of each tag that reported
+            records = rows.records
+            _, first = np.unique(records['tag'][::-1], return_index=True)
+            latest = records[np.sort(len(records) - 1 - first)]
+            self.tag_manager.update_tag_positions([rows.tags.value(code) for code in latest['tag'].tolist()],
+                                                  latest['x'], latest['y'], latest['z'], latest['timestamp'], battery=50)
+
+        kinematics = self.kinematics.snapshot() if self.kinematics is not None else None
+        self.alarm_stage.put(StateSnapshot(tick.created, self.tag_manager.snapshot(), kinematics))
+        if len(rows):
+            with self.trail_lock:
+                self.trail_rows.append((tick.created, rows))
+        self.render_stage.put(tick)
+        self.persistence_stage.put(tick)
+
+    def _check_alarms(self, state):
+        sequence_name, tags, cranes, geofence_zones = getSnapshotSequenceData(state.tags, self.sequence_data)
+        self.alarm_manager.run_alarm_checks(sequence_name, tags, cranes, geofence_zones, kinematics=state.kinematics)
+
+    def _render(self, tick):
+        # Add the rows of this tick and of the ticks skipped before it, but not of newer ticks
+        with self.trail_lock:
+            count = sum(1 for created, _ in self.trail_rows if created <= tick.created)
+            trail_rows, self.trail_rows = self.trail_rows[:count], self.trail_rows[count:]
+        for _, rows in trail_rows:
+            self.plotter.add_trail_rows(rows)
+        # Show every tag at its latest position, however long ago it last reported
+        self.plotter.render(tick.frame_rows, tick.coordinate_time, self.initial_coordinate_time, latest_within=None,
+                            new_rows=())
+        add_frame(self.plotter.capture_frame(), self.video_writer_state)
+
+    def _persist(self, tick):
+        self.tag_manager.reload_if_changed()
+        now = time.monotonic()
+        if now - self.last_persisted >= self.persistence_interval:
+            self.tag_manager.flush()
+            self.last_persisted = now
+
+    def run(self, ticks):
+        """
+        Runs the pipeline over an iterable of Ticks (e.g. replay_ticks) until it is exhausted, then
+        lets every stage finish and writes any pending tag changes.
+        """
+        for stage in self.stages:
+            stage.start()
+        ingest = threading.Thread(target=self._ingest, args=(ticks,), name='ingest', daemon=True)
+        ingest.start()
+        try:
+            while ingest.is_alive():
+                ingest.join(0.5)
+        finally:
+            # Stop the stages in order, so each one gets everything its upstream stage produced
+            for stage in self.stages:
+                stage.close()
+            self.tag_manager.flush()
+
+    def _ingest(self, ticks):
+        self.ingest_started = time.monotonic()
+        for tick in ticks:
+            self.state_stage.put(tick)
+            self.ingested += 1
+        self.ingest_stopped = time.monotonic()
+
+    def stats(self):
+        """Returns the counters of every stage by name, see Stage.stats."""
+        elapsed = (self.ingest_stopped or time.monotonic()) - self.ingest_started if self.ingest_started else 0.0
+        stats = {'ingest': {'processed': self.ingested, 'throughput': self.ingested / elapsed if elapsed > 0 else 0.0}}
+        for stage in self.stages:
+            stats[stage.name] = stage.stats()
+        return stats
+
+    def print_stats(self):
+        for name, stats in self.stats().items():
+            line = f"{name}: {stats['processed']} processed, {stats['throughput']:.1f}/s"
+            if 'dropped' in stats:
+                line += (f", {stats['dropped']} skipped, {stats['errors']} errors, {100 * stats['busy']:.0f}% busy, "
+                         f"latency {1000 * stats['mean_latency']:.1f} ms mean / {1000 * stats['max_latency']:.1f} ms max")
+            if 'late' in stats:
+                line += f", {stats['late']} late, {stats['idle']} idle"
+            print(line)
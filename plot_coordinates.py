@@ -7,7 +7,6 @@ import matplotlib.colors as mcolors
 from tag_manager import TagManager
 from sequence import Sequence
 from PIL import Image
-from tag import Tag
 import numpy as np
 from matplotlib.offsetbox import TextArea, DrawingArea, OffsetImage, AnnotationBbox
 from matplotlib.patches import Rectangle
@@ -15,17 +14,26 @@ from alarms import AlarmManager
 import os
 import json
 from video_maker import add_frame
-from video_maker import convert_plot_to_frame
-
-def plot_alerts(ax, data_json_path):
-    # Load alerts data from JSON file
-    with open(data_json_path, 'r') as file:
-        data = json.load(file)
-    alerts = data['alerts']
-    tags = data['tags']
+from video_maker import convert_plot_to_frame, fit_figure_to_frame
+from coordinate_extractor import CoordinateTable
+
+# Icon zoom for each tag type
+ICON_ZOOM = {'Crane': 0.15, 'Forklift': 0.042, 'Operator': 0.05}
+
+def plot_alerts(ax, data_json_path=None, snapshot=None):
+    if snapshot is not None:
+        # Use the in-memory state of the TagManager
+        alerts = snapshot.alerts
+        tags = snapshot.tags
+    else:
+        # Load alerts data from JSON file
+        with open(data_json_path, 'r') as file:
+            data = json.load(file)
+        alerts = data['alerts']
+        tags = data['tags']
     
     # Sort alerts by timestamp, newest first
-    alerts.sort(key=lambda x: x['timestamp'], reverse=True)
+    alerts = sorted(alerts, key=lambda x: x['timestamp'], reverse=True)
     
     # Determine where to place the first alert box
     # Set some starting coordinates for the alerts below the plot
@@ -33,6 +41,7 @@ def plot_alerts(ax, data_json_path):
     spacing = 0.08  # Space between boxes
     
     # Loop through alerts and create boxes
+    boxes = []
     for i, alert in enumerate(alerts):
         tag_id = alert['tag_id']
         tag_type = tags[tag_id]['tag_type']
@@ -41,9 +50,11 @@ def plot_alerts(ax, data_json_path):
         text_box = TextArea(message, textprops=dict(color='red', fontsize=10, weight='bold'))
         abox = AnnotationBbox(text_box, (start_x, start_y - i * spacing), xycoords='axes fraction', boxcoords="axes fraction", box_alignment=(0,1), frameon=True, pad=0.5, bboxprops=dict(facecolor='lightgray', edgecolor='none', alpha=0.5))
         ax.add_artist(abox)
+        boxes.append(abox)
 
     # Adjust the plot area to make space for alerts
-    plt.subplots_adjust(bottom=0.29)
+    ax.figure.subplots_adjust(bottom=0.29)
+    return boxes
 
 # Helper function to plot crane barriers
 def plotCraneBarrier(ax, tag_id, tag_type, x, y, z, crane_plots):
@@ -87,46 +98,467 @@ def load_json_data(file_path):
     with open(file_path, 'r') as file:
         return json.load(file)
     
+# Icon file for each tag type, in the media directory
+ICON_FILES = {'Forklift': 'forklift.png', 'Crane': 'crane.png', 'Operator': 'operator.png'}
+
+class SpriteCache:
+    """
+    Decoded tag icons, scaled once per (tag_type, zoom) to their size on screen.
+
+    Opening and decoding a PNG and resampling it for the zoom used to happen for every tag on
+    every frame; with the cache each icon is read from disk once and drawn 1:1 afterwards.
+    """
+    def __init__(self, media_file_path=None, dpi=None):
+        """
+        :param media_file_path: Directory holding the icon files. Defaults to ./media in the working directory.
+        :param dpi: Figure DPI the sprites are scaled for. Defaults to matplotlib's figure.dpi.
+        """
+        self.media_file_path = media_file_path
+        self.dpi = dpi
+        self.sprites = {}
+
+    def get(self, tag_type, zoom):
+        """Returns the RGBA pixels of the icon for tag_type, scaled by zoom."""
+        key = (tag_type, zoom)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            return sprite
+
+        # Check if the provided tag_type has an icon
+        if tag_type not in ICON_FILES:
+            raise ValueError(f"Invalid tag_type: {tag_type}. Choose from {list(ICON_FILES.keys())}.")
+
+        media_file_path = self.media_file_path or os.path.join(os.getcwd(), "./media")
+        dpi = self.dpi or plt.rcParams['figure.dpi']
+        # Same size on screen as OffsetImage(icon_image, zoom=zoom), which scales by zoom * dpi / 72
+        scale = zoom * dpi / 72
+        with Image.open(os.path.join(media_file_path, ICON_FILES[tag_type])) as icon_image:
+            icon_image = icon_image.convert('RGBA')
+            size = (max(1, round(icon_image.width * scale)), max(1, round(icon_image.height * scale)))
+            sprite = np.asarray(icon_image.resize(size, Image.LANCZOS))
+        self.sprites[key] = sprite
+        return sprite
+
+    def make_icon(self, ax, tag_type, x, y, zoom):
+        """Adds an AnnotationBbox showing the icon for tag_type at (x, y) to ax and returns it."""
+        # The sprite is already at its final size, so draw it without further scaling
+        imagebox = OffsetImage(self.get(tag_type, zoom), dpi_cor=False)
+        ab = AnnotationBbox(imagebox, (x, y), frameon=False)
+        ax.add_artist(ab)
+        return ab
+
+# Shared by every plot in the process
+sprite_cache = SpriteCache()
+
+def move_icon(ab, x, y):
+    """Moves an AnnotationBbox created by plot_icons to (x, y)."""
+    ab.xy = (x, y)
+    ab.xybox = (x, y)
+    ab.set_visible(True)
+
 def plot_icons(ax, tag_type, x, y, zoom):
     """
     Plots an icon on a given axis based on tag_type at specified (x, y) coordinates with a given zoom level.
 
+    Icons come from sprite_cache, so the image files are only read once. To animate an icon,
+    keep the returned artist and move it with move_icon rather than plotting it again.
+
     Parameters:
     - ax (matplotlib.axes.Axes): The axis on which to plot the icons.
     - tag_type (str): The type of the tag (e.g., 'Forklift', 'Crane', 'Operator').
     - x (float): The x-coordinate for the icon placement.
     - y (float): The y-coordinate for the icon placement.
     - zoom (float): The zoom level for the icon size.
+
+    Returns:
+    - AnnotationBbox: The icon artist.
+    """
+    return sprite_cache.make_icon(ax, tag_type, x, y, zoom)
+
+def frame_columns(coordinate_data):
     """
+    Returns the columns needed to draw a frame as (serial_numbers, x, y, z, timestamps), where
+    serial_numbers is a list and the others are float arrays. A CoordinateTable is used as is;
+    a list of rows is parsed with float().
+    """
+    if isinstance(coordinate_data, CoordinateTable):
+        records = coordinate_data.records
+        serial_numbers = [coordinate_data.tags.value(code) for code in records['tag'].tolist()]
+        return serial_numbers, records['x'], records['y'], records['z'], records['timestamp']
 
-    # Define the media file path
-    media_file_path = os.path.join(os.getcwd(), "./media")
+    serial_numbers = [data_point[1] for data_point in coordinate_data]
+    columns = np.array([[float(data_point[2]), float(data_point[3]), float(data_point[4]), float(data_point[6])]
+                        for data_point in coordinate_data], dtype=np.float64).reshape(-1, 4)
+    return serial_numbers, columns[:, 0], columns[:, 1], columns[:, 2], columns[:, 3]
 
-    # Dictionary to hold paths for different tag types
-    icon_paths = {
-        'Forklift': os.path.join(media_file_path, 'forklift.png'),
-        'Crane': os.path.join(media_file_path, 'crane.png'),
-        'Operator': os.path.join(media_file_path, 'operator.png')
-    }
 
-    # Check if the provided tag_type is in the predefined dictionary
-    if tag_type not in icon_paths:
-        raise ValueError(f"Invalid tag_type: {tag_type}. Choose from {list(icon_paths.keys())}.")
+class TrailBuffer:
+    """
+    Fixed-capacity ring buffers of the recent reports of every tag, for the fading trail.
 
-    # Load the appropriate icon image
-    icon_path = icon_paths[tag_type]
-    icon_image = Image.open(icon_path)
+    Each tag keeps its last capacity positions, timestamps and arrival sequence numbers in
+    preallocated arrays. Selecting the points to draw and their fade are whole-array operations
+    over tags x capacity, so the cost of the trail does not depend on how often tags report.
+    """
+    def __init__(self, capacity=64):
+        """
+        :param capacity: Number of reports kept per tag. At least as many as a tag sends in a second
+                         (the length of the fade) keeps every point of the trail.
+        """
+        if capacity < 1:
+            raise ValueError("Capacity must hold at least one report.")
+        self.capacity = capacity
+        self.index = {}  # Tag ID -> row of the arrays below
+        self.positions = np.full((0, capacity, 4), np.nan)  # x, y, z, timestamp
+        self.sequence = np.full((0, capacity), -1, dtype=np.int64)  # Arrival order, -1 for an empty slot
+        self.heads = np.zeros(0, dtype=np.int64)  # Next slot to write per tag
+        self.count = 0  # Reports added so far
+
+    def _rows(self, serial_numbers):
+        rows = np.array([self.index.setdefault(serial, len(self.index)) for serial in serial_numbers], dtype=np.int64)
+        if len(self.index) > len(self.heads):
+            # Grow by doubling so adding tags stays cheap
+            grow = max(len(self.index), 2 * len(self.heads)) - len(self.heads)
+            self.positions = np.concatenate([self.positions, np.full((grow, self.capacity, 4), np.nan)])
+            self.sequence = np.concatenate([self.sequence, np.full((grow, self.capacity), -1, dtype=np.int64)])
+            self.heads = np.concatenate([self.heads, np.zeros(grow, dtype=np.int64)])
+        return rows
+
+    def extend(self, serial_numbers, x, y, z, timestamps):
+        """Adds reports in order of arrival. Only the last capacity reports of each tag are kept."""
+        if len(serial_numbers) == 0:
+            return
+        rows = self._rows(serial_numbers)
+
+        # Position of each report among the new reports of its tag
+        order = np.argsort(rows, kind='stable')
+        sorted_rows = rows[order]
+        rank = np.empty(len(rows), dtype=np.int64)
+        rank[order] = np.arange(len(rows)) - np.searchsorted(sorted_rows, sorted_rows, side='left')
+        counts = np.bincount(rows, minlength=len(self.heads))
+        keep = rank >= counts[rows] - self.capacity
+
+        slots = (self.heads[rows] + rank) % self.capacity
+        self.positions[rows[keep], slots[keep]] = np.column_stack([x, y, z, timestamps])[keep]
+        self.sequence[rows[keep], slots[keep]] = self.count + np.flatnonzero(keep)
+        self.heads = (self.heads + counts) % self.capacity
+        self.count += len(rows)
+
+    def points(self, bounds, oldest, coordinate_time=None, latest_within=None, fade=1.0):
+        """
+        Returns the points of the trail as (x, y, z, elapsed) arrays in order of arrival, where
+        elapsed is the time from each report to the latest selected report of the same tag.
+
+        :param bounds: (xLow, xHigh, yLow, yHigh). Reports outside are not selected.
+        :param oldest: Reports older than this timestamp are not selected.
+        :param coordinate_time, latest_within: If given, reports that arrived after the first selected
+                                               report less than latest_within seconds older than
+                                               coordinate_time are not selected.
+        :param fade: Reports more than this many seconds older than the latest selected report of their tag are left out.
+        """
+        x, y, z, timestamps = (self.positions[..., i] for i in range(4))
+        x_low, x_high, y_low, y_high = bounds
+        selected = ((self.sequence >= 0) & (timestamps >= oldest) &
+                    (x >= x_low) & (x <= x_high) & (y >= y_low) & (y <= y_high))
+        if latest_within is not None:
+            recent = selected & (coordinate_time - timestamps < latest_within)
+            if recent.any():
+                selected &= self.sequence <= self.sequence[recent].min()
+        latest = np.where(selected, timestamps, -np.inf).max(axis=1, initial=-np.inf)
+        elapsed = latest[:, None] - timestamps
+        selected &= elapsed <= fade
+
+        order = np.argsort(self.sequence[selected], kind='stable')
+        return x[selected][order], y[selected][order], z[selected][order], elapsed[selected][order]
+
+    def clear(self):
+        self.index.clear()
+        self.positions = np.full((0, self.capacity, 4), np.nan)
+        self.sequence = np.full((0, self.capacity), -1, dtype=np.int64)
+        self.heads = np.zeros(0, dtype=np.int64)
+        self.count = 0
+
+
+class CoordinatePlotter:
+    """
+    Long-lived renderer for the tag visualisation.
 
-    # Create an OffsetImage for the icon
-    imagebox = OffsetImage(icon_image, zoom=zoom)
+    The figure, background map and geofences are created once. Each frame only updates the
+    dynamic artists (fading points, latest positions, icons, crane barriers, the timestamp and
+    the alert boxes): the static part of the canvas is restored from a saved copy and only the
+    dynamic artists are drawn on top of it (blitting).
+    """
+    def __init__(self, xLow, xHigh, yLow, yHigh, zLow, zHigh, tag_manager, sequence_data=None, toggle_names=False,
+                 frame_size=None, update_tags=True, trail_capacity=64):
+        """
+        :param xLow, xHigh, yLow, yHigh: Bounds of the map.
+        :param zLow, zHigh: Bounds of the Z coordinate for the colour gradient.
+        :param tag_manager: TagManager providing tag types and alerts; it is updated with the latest tag positions.
+        :param sequence_data: Contents of sequence_data.json. Loaded from the working directory if not given.
+        :param toggle_names: Toggle to show/hide tag names on the plot.
+        :param frame_size: Video frame size (width, height) to size the figure to, if frames will be captured.
+        :param update_tags: Write the latest tag positions to tag_manager. Turn off when something else owns the tag state.
+        :param trail_capacity: Number of recent reports per tag kept for the fading trail.
+        """
+        self.xLow, self.xHigh, self.yLow, self.yHigh, self.zLow, self.zHigh = xLow, xHigh, yLow, yHigh, zLow, zHigh
+        self.tag_manager = tag_manager
+        self.toggle_names = toggle_names
+        self.update_tags = update_tags
+        if sequence_data is None:
+            sequence_data = load_json_data(os.path.join(os.getcwd(), "sequence_data.json"))
+        self.sequence_data = sequence_data
+
+        self.fig, self.ax = plt.subplots()
+        if frame_size is not None:
+            fit_figure_to_frame(self.fig, frame_size)
+        ax = self.ax
+
+        # Static artists: background map and geofences
+        media_file_path = os.path.join(os.getcwd(), "./media")
+        bg_image = Image.open(os.path.join(media_file_path, 'mapBackground.png'))
+        ax.imshow(bg_image, extent=[xLow, xHigh, yLow, yHigh], aspect='auto', alpha=0.8)
+        ax.set_xlim(xLow, xHigh)
+        ax.set_ylim(yLow, yHigh)
+        self.geofence_patches = []
+        self.selected_sequence = None
+        self._update_geofence()
+
+        # Make space for the alerts below the plot
+        self.fig.subplots_adjust(bottom=0.29)
+
+        # Dynamic artists, updated in place every frame
+        self.trail = ax.scatter(np.empty(0), np.empty(0))
+        self.trail_buffer = TrailBuffer(trail_capacity)
+        self.latest = ax.scatter(np.empty(0), np.empty(0))
+        self.time_text = ax.text(0.95, 0.95, '', transform=ax.transAxes, fontsize=12,
+                                 verticalalignment='top', horizontalalignment='right')
+        self.crane_plots = {}
+        self.icons = {}  # Tag ID -> (tag_type, AnnotationBbox), reused between frames
+        self.alert_boxes = []
+        self.alerts = None
+
+        self.background = None
+
+    def _update_geofence(self):
+        # Re-plot the geofence if the selected sequence has changed (e.g. from the web application)
+        settings = self.tag_manager.snapshot().settings
+        selected_sequence = settings.get('selected_sequence', 'Default Sequence')
+        if selected_sequence == self.selected_sequence:
+            return False
+
+        for patch in self.geofence_patches:
+            patch.remove()
+        selected_data_set = settings.get('selected_data_set', 'Default Dataset')
+        path, quadrilaterals, colour = get_sequence_data(self.sequence_data, selected_sequence, selected_data_set)
+        patches_before = len(self.ax.patches)
+        if quadrilaterals is not None:
+            current_sequence = Sequence(selected_sequence, quadrilaterals, colour)
+            current_sequence.plot_geofence(self.ax, 0.25, colour)
+        self.geofence_patches = list(self.ax.patches[patches_before:])
+        self.selected_sequence = selected_sequence
+        return True
+
+    def dynamic_artists(self):
+        return [self.trail, self.latest, *self.crane_plots.values(),
+                *(icon for _, icon in self.icons.values()), self.time_text, *self.alert_boxes]
+
+    def _save_background(self):
+        # Draw the static part of the figure once and keep a copy of the pixels
+        dynamic = self.dynamic_artists()
+        for artist in dynamic:
+            artist.set_visible(False)
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in dynamic:
+            artist.set_visible(True)
+
+    def render(self, coordinate_data, coordinate_time, initial_coordinate_time, draw=True, latest_within=0.1,
+               new_rows=None):
+        """
+        Draws one frame.
+
+        :param coordinate_data: Rows of the current window (a CoordinateTable or list of rows), oldest first.
+        :param coordinate_time: The log time this frame represents.
+        :param initial_coordinate_time: Log time of the start of the replay.
+        :param draw: Draw the frame. With False only the tags and artists are updated, e.g. to fast-forward.
+        :param latest_within: Rows are drawn up to the first one that is within this many seconds of
+                              coordinate_time, and the tags are only shown if there is one. None draws
+                              every row and always shows the latest position of each tag.
+        :param new_rows: The rows that arrived since the previous frame (e.g. from ReplayWindow.new_rows), in
+                         order of arrival, which are added to the fading trail. None rebuilds the trail from
+                         coordinate_data, e.g. for the first frame of a plotter that starts mid-replay.
+        """
+        if self._update_geofence():
+            self.background = None
+
+        serial_numbers, x, y, z, timestamps = frame_columns(coordinate_data)
+        if new_rows is None:
+            self.trail_buffer.clear()
+            self.trail_buffer.extend(serial_numbers, x, y, z, timestamps)
+        else:
+            self.add_trail_rows(new_rows)
+
+        # Only points within the display bounds are drawn
+        shown = np.flatnonzero((x >= self.xLow) & (x <= self.xHigh) & (y >= self.yLow) & (y <= self.yHigh))
+
+        if latest_within is None:
+            caught_up = len(shown) > 0
+        else:
+            # Draw points up to and including the first one that is less than latest_within seconds old
+            recent = np.flatnonzero(coordinate_time - timestamps[shown] < latest_within)
+            caught_up = len(recent) > 0
+            if caught_up:
+                shown = shown[:recent[0] + 1]
+
+        # Each point fades out over the second after it, measured against the latest point of the same tag.
+        # Like the rows of the window, the trail stops at the first report that is less than latest_within old.
+        oldest = timestamps.min() if len(timestamps) else np.inf
+        trail_x, trail_y, trail_z, elapsed = self.trail_buffer.points((self.xLow, self.xHigh, self.yLow, self.yHigh),
+                                                                      oldest, coordinate_time, latest_within)
+        # Normalize z for the colour gradient
+        trail_colours = plt.cm.viridis((trail_z - self.zLow) / (self.zHigh - self.zLow))
+        trail_colours[:, 3] = np.maximum(0, 1 - elapsed)
+        self.trail.set_offsets(np.column_stack([trail_x, trail_y]))
+        self.trail.set_facecolors(trail_colours)
+        self.trail.set_edgecolors(trail_colours)
+
+        # Index of the latest shown row of each tag, in order of first appearance
+        codes = {}
+        tag_codes = np.array([codes.setdefault(serial_numbers[i], len(codes)) for i in shown], dtype=np.int64)
+        last_index = np.full(len(codes), -1, dtype=np.int64)
+        np.maximum.at(last_index, tag_codes, np.arange(len(shown)))
+
+        updated_cranes = set()
+        updated_icons = set()
+
+        if caught_up:
+            # Display time in the top right corner
+            dt = datetime.fromtimestamp(int(timestamps[shown[-1]]))
+            if dt != datetime.fromtimestamp(int(initial_coordinate_time)):
+                self.time_text.set_text(dt.strftime('%Y-%m-%d %H:%M:%S'))
+            else:
+                self.time_text.set_text('')
+
+            # Process and plot the latest known instances of all tags, in order of first appearance
+            latest = last_index
+            colours = plt.cm.viridis((z[shown][latest] - self.zLow) / (self.zHigh - self.zLow))
+            self.latest.set_offsets(np.column_stack([x[shown][latest], y[shown][latest]]))
+            self.latest.set_facecolors(colours)
+            self.latest.set_edgecolors(colours)
+
+            for serial, i in zip(codes, latest.tolist()):
+                x_last, y_last, z_last = float(x[shown[i]]), float(y[shown[i]]), float(z[shown[i]])
+                tag_type = self.tag_manager.get_tag_type(serial)
+                print(f"Processing tag_id: {serial}, tag_type: {tag_type}")
 
-    # Place the icon at the given coordinates on the provided axis
-    ab = AnnotationBbox(imagebox, (x, y), frameon=False)
-    ax.add_artist(ab)
+                if tag_type == "Crane":
+                    # If the tag is a crane, plot the crane barrier
+                    self._update_crane_barrier(serial, x_last, y_last, z_last)
+                    updated_cranes.add(serial)
 
-def plot_coordinates(coordinate_data, xLow, xHigh, yLow, yHigh, zLow, zHigh, initial_time, initial_coordinate_time, toggle_names=False, video_writer_state=None):
+                # Plot the icon of the tag type at the correct location
+                self._update_icon(serial, tag_type, x_last, y_last)
+                updated_icons.add(serial)
+
+            # Update the tags in the JSON file
+            if self.update_tags:
+                rows = shown[latest]
+                self.tag_manager.update_tag_positions(list(codes), x[rows], y[rows], z[rows], timestamps[rows], battery=50)
+        else:
+            self.time_text.set_text('')
+            self.latest.set_offsets(np.empty((0, 2)))
+
+        for serial, circle in self.crane_plots.items():
+            circle.set_visible(serial in updated_cranes)
+        for serial, (_, icon) in self.icons.items():
+            if serial not in updated_icons:
+                icon.set_visible(False)
+
+        if draw:
+            self._update_alerts()
+            self._blit()
+
+    def add_trail_rows(self, rows):
+        """Adds rows (a CoordinateTable or list of rows) to the fading trail in order of arrival."""
+        if len(rows):
+            serial_numbers, x, y, z, timestamps = frame_columns(rows)
+            self.trail_buffer.extend(serial_numbers, x, y, z, timestamps)
+
+    def artist_order(self):
+        """
+        Returns the crane barriers and icons created so far, in the order they are drawn, as
+        {'cranes': [tag_id, ...], 'icons': [(tag_id, tag_type), ...]}.
+        """
+        return {'cranes': list(self.crane_plots),
+                'icons': [(tag_id, tag_type) for tag_id, (tag_type, _) in self.icons.items()]}
+
+    def restore_artist_order(self, order):
+        """
+        Creates hidden crane barriers and icons in the order returned by artist_order, so that a
+        new plotter draws overlapping artists exactly like the plotter the order was taken from.
+        """
+        for tag_id in order['cranes']:
+            self._update_crane_barrier(tag_id, 0.0, 0.0, 0.0)
+            self.crane_plots[tag_id].set_visible(False)
+        for tag_id, tag_type in order['icons']:
+            self._update_icon(tag_id, tag_type, 0.0, 0.0)
+            self.icons[tag_id][1].set_visible(False)
+
+    def _update_crane_barrier(self, tag_id, x, y, z):
+        # A red circle around the crane with a radius equal to its Z coordinate
+        if tag_id in self.crane_plots:
+            circle = self.crane_plots[tag_id]
+            circle.set_center((x, y))
+            circle.set_radius(z)
+        else:
+            plotCraneBarrier(self.ax, tag_id, "Crane", x, y, z, self.crane_plots)
+
+    def _update_icon(self, tag_id, tag_type, x, y):
+        # Move the tag's icon, creating it the first time and whenever the tag type changes
+        if tag_id in self.icons:
+            icon_type, icon = self.icons[tag_id]
+            if icon_type == tag_type:
+                move_icon(icon, x, y)
+                return
+            icon.remove()
+            del self.icons[tag_id]
+        icon = plot_icons(self.ax, tag_type, x, y, ICON_ZOOM.get(tag_type))
+        self.icons[tag_id] = (tag_type, icon)
+
+    def _update_alerts(self):
+        # Alert boxes are only rebuilt when the alerts change
+        snapshot = self.tag_manager.snapshot()
+        if snapshot.alerts == self.alerts:
+            return
+        for box in self.alert_boxes:
+            box.remove()
+        self.alert_boxes = plot_alerts(self.ax, snapshot=snapshot)
+        self.alerts = snapshot.alerts
+
+    def _blit(self):
+        if self.background is None:
+            self._save_background()
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for artist in self.dynamic_artists():
+            if artist.get_visible():
+                self.ax.draw_artist(artist)
+        canvas.blit(self.fig.bbox)
+
+    def capture_frame(self):
+        """Returns the last rendered frame as a BGR array for the video, without redrawing the figure."""
+        return convert_plot_to_frame(self.fig, draw=False)
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def plot_coordinates(coordinate_data, xLow, xHigh, yLow, yHigh, zLow, zHigh, initial_time, initial_coordinate_time, toggle_names=False, video_writer_state=None, tag_manager=None):
     """
-    Plot tag coordinates on a 2D graph with real-time animation and save as a GIF.
+    Plot tag coordinates on a 2D graph as a single frame, optionally adding it to a video.
+
+    This builds a new CoordinatePlotter on every call; for a sequence of frames create one
+    CoordinatePlotter and call its render method instead.
     
     Args:
     coordinate_data (list of lists): Matrix containing tag data.
@@ -134,165 +566,26 @@ def plot_coordinates(coordinate_data, xLow, xHigh, yLow, yHigh, zLow, zHigh, ini
     yLow, yHigh (float): Bounds for the Y-axis.
     zLow, zHigh (float): Bounds for the Z-axis to color gradient.
     toggle_names (bool): Toggle to show/hide tag names on the plot.
+    tag_manager (TagManager): Tag manager to update. If not given, one is created for data.json and flushed before returning.
     """
     # Instantiate Tag Manager
-    tag_manager = TagManager('data.json')
-    
-    # Define the media files directory path
-    media_file_path = os.path.join(os.getcwd(), "./media")
-    bg_image_path = os.path.join(media_file_path, 'mapBackground.png')  # Update with your background image path
-    bg_image = Image.open(bg_image_path)
-    
-    # Get relevant sequence data:
-    file_path = os.path.join(os.getcwd(), "sequence_data.json")
-    sequence_data = load_json_data(file_path)
-    selected_data_set = tag_manager.data['settings'].get('selected_data_set', 'Default Dataset')
-    selected_sequence = tag_manager.data['settings'].get('selected_sequence', 'Default Sequence')
-    path, quadrilaterals, colour = get_sequence_data(sequence_data, selected_sequence, selected_data_set)
-    
-    # Create Current Sequence:
-    current_sequence = Sequence(selected_sequence, quadrilaterals, colour)
-    
-    fig, ax = plt.subplots()
-
-    ax.imshow(bg_image, extent=[xLow, xHigh, yLow, yHigh], aspect='auto', alpha=0.8)
-
-    ax.set_xlim(xLow, xHigh)
-    ax.set_ylim(yLow, yHigh)
-    
-    
-    
-    current_sequence.plot_geofence(ax, 0.25, colour)
-
-    # Dictionary to store plot objects and their times
-    plots = {}
-
-    # Dictionary to track crane barrier plots
-    crane_plots = {}
-
-    #initial_time = time.time()
-    #initial_coordinate_time = float(coordinate_data[0][6])
-    dtPrevious = datetime.fromtimestamp(int(initial_coordinate_time))
-    uhPrevious = datetime.fromtimestamp(int(initial_time))
-    text_obj = None
-    
-    #for data_point in coordinate_data:
-    #    serial_number, x, y, z, timestamp = data_point[1], float(data_point[2]), float(data_point[3]), float(data_point[4]), float(data_point[6])
+    owns_tag_manager = tag_manager is None
+    if owns_tag_manager:
+        tag_manager = TagManager('data.json')
 
-    current_time = time.time()
+    frame_size = video_writer_state.frame_size if video_writer_state is not None else None
+    plotter = CoordinatePlotter(xLow, xHigh, yLow, yHigh, zLow, zHigh, tag_manager, toggle_names=toggle_names,
+                                frame_size=frame_size)
 
-    # Dictionary to track the most recent instance of each tag
-    latest_tag_data = {}
-    
-        
-    for data_point in coordinate_data:
-        current_time = time.time()
-        #time_diff = current_time - initial_time
-        #coordinate_time_diff = float(coordinate_data[0][6]) - initial_coordinate_time
-        serial_number, x, y, z, timestamp = data_point[1], float(data_point[2]), float(data_point[3]), float(data_point[4]), float(data_point[6])
-
-        # Check if the data point falls within the display bounds
-        if not (xLow <= x <= xHigh and yLow <= y <= yHigh):
-            continue
-
-        # Let's say it has been 14 seconds since we started plotting,
-        # The current point we are looking it has only been 13 seconds since starting
-        # Therefore, we are looking at a point that should have been plotted 1 second ago.
-        time_diff = current_time - initial_time # E.g: 17-3=14
-        coordinate_time_diff = timestamp - initial_coordinate_time # E.g: 15-2=13
-        time_since_added = time_diff - coordinate_time_diff # E.g 14-13=1
-
-        # Normalize z for color gradient and create scatter plot
-        color_value = (z - zLow) / (zHigh - zLow)
-        color = plt.cm.viridis(color_value)
-        scatter_plot = ax.scatter(x, y, color=color, alpha=1.0, label=serial_number if toggle_names else None)
-
-        if serial_number not in plots:
-            plots[serial_number] = []
-        plots[serial_number].append((scatter_plot, timestamp))
-        #print('ADDED POINT \n')
-
-        # Store the latest instance of each tag in the dictionary
-        latest_tag_data[serial_number] = (x, y, z, timestamp, color)
-        
-
-        # Iterate through all points for the current tag and fade/remove old ones
-        for plot, added_time in plots[serial_number]:
-            elapsed_time = timestamp - added_time
-            alpha = max(0, 1 - elapsed_time)  # Fade out over 1 second
-            plot.set_alpha(alpha)
-
-            if elapsed_time > 1:
-                plot.remove()
-                #print('****REMOVED POINT\n')
-
-        # Remove entries that have been fully removed from the screen
-        plots[serial_number] = [(plot, added_time) for plot, added_time in plots[serial_number] if timestamp - added_time <= 1]
-
-        if ((time_since_added < 0.1)): # This makes sure you are updating the JSON file with the new tag info
-            # Display time in the top right corner
-            dt = datetime.fromtimestamp(int(timestamp))
-            if (dt != dtPrevious):
-                if text_obj is not None:
-                    text_obj.remove()
-                text_obj = ax.text(0.95, 0.95, dt.strftime('%Y-%m-%d %H:%M:%S'), transform=ax.transAxes, fontsize=12,
-                    verticalalignment='top', horizontalalignment='right')
-            
-            #tag_type = tag_manager.get_tag_type(serial_number)
-            
-            # Create a new Tag instance
-            #tag = Tag(tag_type, serial_number, 50, (x, y, z), timestamp)
-            
-            # Plot the icon of the tag type at the correct location
-            #plot_icons(ax, tag_type, x, y, zoom=0.03)
-            
-            # Update the tag in the JSON file
-            #tag_manager.add_or_update_tag(tag)
-            #tag.get_tag_type(tag)
-
-            # Here, before breaking, process and plot the latest known instances of **all** tags
-            for serial, (x_last, y_last, z_last, ts_last, color_last) in latest_tag_data.items():
-                # Plot the last known position for each tag
-                ax.scatter(x_last, y_last, color=color_last, alpha=1.0)  # Scatter for last known tag position
-                tag_type = tag_manager.get_tag_type(serial)
-
-
-                print(f"Processing tag_id: {serial}, tag_type: {tag_type}")
-                # Ensure only "Crane" tag_type calls the function
-                if tag_type == "Crane":
-                    zoom = 0.15
-                    #print("Plotting Crane circle \n")
-                    # If the tag is a crane, plot the crane barrier
-                    plotCraneBarrier(ax, serial, tag_type, x_last, y_last, z_last, crane_plots)
-
-                if tag_type == "Forklift":
-                    zoom = 0.042
-                if tag_type == "Operator":
-                    zoom = 0.05
-                # Create a new Tag instance
-                tag = Tag(tag_type, serial, 50, (x_last, y_last, z_last), ts_last)
-                # Update the tag in the JSON file
-                tag_manager.add_or_update_tag(tag)
-            
-                # Plot the icon of the tag type at the correct location
-                plot_icons(ax, tag_type, x_last, y_last, zoom)
-
-                #plot_icons(ax, tag_type, x_last, y_last, zoom=0.03)  # Icon for the last known position
+    # The log time that corresponds to now
+    coordinate_time = initial_coordinate_time + (time.time() - initial_time)
+    plotter.render(coordinate_data, coordinate_time, initial_coordinate_time)
 
-
-            break # Don't look at future data just yet, therefore break
-        
-        # Grab the current frame for the GIF
-        #writer.grab_frame()
-        #ax.cla()  # Clear the axis for the next frame
-    data_json_path = os.path.join(os.getcwd(), "data.json")
-    plot_alerts(ax, data_json_path)
-    #plot_alerts(ax, tag_manager.data['alerts'], tag_manager.data['tags'])
-    
-    #plt.show()
     # Convert the plot to a frame and add it to the video if video_writer_state is provided
     if video_writer_state is not None:
-        # Convert the plot to a frame (example using plt)
-        frame = convert_plot_to_frame()  # A function that captures the plot as an image
+        frame = plotter.capture_frame()  # Capture the plot as an image
         add_frame(frame, video_writer_state)  # Add the frame to the video
-    plt.close(fig)
+    plotter.close()
+
+    if owns_tag_manager:
+        tag_manager.flush()
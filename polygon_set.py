@@ -0,0 +1,64 @@
+import numpy as np
+
+class PolygonSet:
+    """
+    A set of polygons (e.g. the quadrilaterals of a geofence) compiled once into edge arrays
+    and bounding boxes, for repeated point-in-polygon tests without matplotlib.
+
+    The crossing test is the same one matplotlib's Path.contains_point uses, so points on or
+    near an edge are classified the same way as before.
+    """
+    def __init__(self, polygons):
+        """
+        :param polygons: List of polygons, where each polygon is a list of (x, y) tuples. Polygons are closed implicitly.
+        """
+        self.polygons = [np.asarray(polygon, dtype=np.float64).reshape(-1, 2) for polygon in polygons]
+        self.count = len(self.polygons)
+
+        # Bounding boxes as (x_min, y_min, x_max, y_max), one row per polygon
+        self.bounds = np.array([[p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max()]
+                                for p in self.polygons]).reshape(-1, 4)
+
+        # Edges from vertex i to vertex i + 1, wrapping around to close each polygon
+        self.edges = [(p[:, 0], p[:, 1], np.roll(p[:, 0], -1), np.roll(p[:, 1], -1)) for p in self.polygons]
+
+    def _contains(self, index, x, y):
+        # Crossing-number test over the edges of one polygon, vectorised over the points
+        inside = np.zeros(len(x), dtype=bool)
+        for x0, y0, x1, y1 in zip(*self.edges[index]):
+            yflag0 = y0 >= y
+            yflag1 = y1 >= y
+            crossing = (yflag0 != yflag1) & ((((y1 - y) * (x0 - x1)) >= ((x1 - x) * (y0 - y1))) == yflag1)
+            inside ^= crossing
+        return inside
+
+    def contains_points(self, points):
+        """
+        Classifies many points against every polygon at once.
+
+        :param points: Array-like of shape (N, 2) with the X, Y of each point.
+        :return: Boolean array of shape (N, count); entry [i, j] is True if point i is inside polygon j.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x, y = points[:, 0], points[:, 1]
+        result = np.zeros((len(points), self.count), dtype=bool)
+
+        for j in range(self.count):
+            x_min, y_min, x_max, y_max = self.bounds[j]
+            # Quick rejection of points outside the bounding box
+            candidates = np.flatnonzero((x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max))
+            if len(candidates):
+                result[candidates, j] = self._contains(j, x[candidates], y[candidates])
+        return result
+
+    def contains_any(self, points):
+        """Returns a boolean array with one entry per point: True if it is inside any polygon."""
+        return self.contains_points(points).any(axis=1)
+
+    def contains_point(self, x, y):
+        """Returns True if (x, y) is inside any polygon."""
+        for j in range(self.count):
+            x_min, y_min, x_max, y_max = self.bounds[j]
+            if x_min <= x <= x_max and y_min <= y <= y_max and self._contains(j, np.array([x]), np.array([y]))[0]:
+                return True
+        return False
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from calibration import SITE_RANGE, getStreamBounds, normalizeCoordinates
+from coordinate_extractor import (COORDINATE_DTYPE, CoordinateTable, StringIndex, concatCoordinateTables,
+                                  iterCoordinateBatches)
+
+# Bump when the cached layout or the parsing/normalisation it stores changes
+CACHE_VERSION = 1
+
+# Suffixes of the cache files written next to a log file
+CACHE_DATA_SUFFIX = '.cache.npy'
+CACHE_INFO_SUFFIX = '.cache.json'
+
+
+def getFileHash(file_path, chunk_size=1 << 20):
+    """Returns the BLAKE2b hash of a file's contents as a hex string."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _normalisation_key(new_range, previous_range):
+    return {
+        'new_range': [float(value) for value in new_range],
+        'previous_range': [float(value) for value in previous_range] if previous_range is not None else None,
+    }
+
+
+def _write_atomically(path, write):
+    # Write to a temporary file in the same directory and move it into place
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def loadCachedTable(log_file_path, new_range=SITE_RANGE, previous_range=None):
+    """
+    Returns (table, previous_range) from the cache of a log file, or None if there is no valid
+    cache for the file in its current state and these normalisation parameters.
+
+    The cached records are memory-mapped read-only, so loading does not depend on the size of the log.
+    """
+    info_path = log_file_path + CACHE_INFO_SUFFIX
+    data_path = log_file_path + CACHE_DATA_SUFFIX
+    try:
+        with open(info_path, 'r') as file:
+            info = json.load(file)
+        stat = os.stat(log_file_path)
+    except (OSError, ValueError):
+        return None
+
+    if (info.get('version') != CACHE_VERSION or info.get('size') != stat.st_size or
+            info.get('normalisation') != _normalisation_key(new_range, previous_range)):
+        return None
+    if info.get('mtime_ns') != stat.st_mtime_ns:
+        # Touched but maybe not changed (e.g. copied or checked out again): compare the contents
+        if info.get('hash') != getFileHash(log_file_path):
+            return None
+        info['mtime_ns'] = stat.st_mtime_ns
+        _write_atomically(info_path, lambda file: file.write(json.dumps(info).encode('utf-8')))
+
+    try:
+        records = np.load(data_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if records.dtype != COORDINATE_DTYPE or len(records) != info.get('rows'):
+        return None
+
+    table = CoordinateTable(records, StringIndex(info['tags']), StringIndex(info['infos']))
+    return table, tuple(info['calibration'])
+
+
+def saveCachedTable(log_file_path, table, new_range, previous_range, calibration):
+    """
+    Writes the cache of a log file: the records of the normalised table as a .npy file and the
+    strings, calibration and cache key as a JSON sidecar. The sidecar is written last, so a cache
+    that was interrupted while being written is never used.
+    """
+    saveCachedBatches(log_file_path, [table], new_range, previous_range, calibration)
+
+
+def saveCachedBatches(log_file_path, batches, new_range, previous_range, calibration):
+    """
+    Writes the cache of a log file like saveCachedTable, from normalised batches that share their
+    string indexes (such as those of iterCoordinateBatches). Only one batch is held in memory at a
+    time: the records are spooled to a temporary file and copied behind the .npy header once the
+    number of rows is known.
+    """
+    stat = os.stat(log_file_path)
+    rows = 0
+    tags, infos = StringIndex(), StringIndex([''])
+    directory = os.path.dirname(os.path.abspath(log_file_path))
+    with tempfile.TemporaryFile(dir=directory) as spool:
+        for batch in batches:
+            spool.write(np.ascontiguousarray(batch.records, dtype=COORDINATE_DTYPE).tobytes())
+            rows += len(batch)
+            tags, infos = batch.tags, batch.infos
+
+        def write_records(file):
+            header = {'descr': np.lib.format.dtype_to_descr(COORDINATE_DTYPE), 'fortran_order': False,
+                      'shape': (rows,)}
+            np.lib.format.write_array_header_1_0(file, header)
+            spool.seek(0)
+            shutil.copyfileobj(spool, file)
+
+        _write_atomically(log_file_path + CACHE_DATA_SUFFIX, write_records)
+
+    info = {
+        'version': CACHE_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'hash': getFileHash(log_file_path),
+        'normalisation': _normalisation_key(new_range, previous_range),
+        'rows': rows,
+        'tags': tags.values,
+        'infos': infos.values,
+        'calibration': [float(value) for value in calibration],
+    }
+    _write_atomically(log_file_path + CACHE_INFO_SUFFIX, lambda file: file.write(json.dumps(info).encode('utf-8')))
+
+
+def getNormalizedTable(log_file_path, new_range=SITE_RANGE, previous_range=None, use_cache=True):
+    """
+    Parses and normalises a log file like getCoordinateTable followed by normalizeCoordinates,
+    reusing the binary cache next to the log when the log and the parameters are unchanged.
+
+    The log is read in batches with iterCoordinateBatches: a first pass finds the recorded extents
+    when no previous_range is given, and a second one normalises each batch and streams it into
+    the cache, which is then memory-mapped. The whole log is therefore never held in memory,
+    unless the cache is not used or cannot be written.
+
+    Args:
+    log_file_path (str): Path to the log file.
+    new_range (tuple): Extents to rescale to. Defaults to the site map.
+    previous_range (tuple): Recorded extents of the data if known (a fixed calibration), else None to scan the data.
+    use_cache (bool): Read and write the cache. If the cache cannot be written the table is still returned.
+
+    Returns:
+    tuple: (CoordinateTable, previous_range) as returned by normalizeCoordinates. A cached table is read-only.
+    """
+    if use_cache:
+        cached = loadCachedTable(log_file_path, new_range, previous_range)
+        if cached is not None:
+            return cached
+
+    calibration = previous_range
+    if calibration is None:
+        calibration = getStreamBounds(iterCoordinateBatches(log_file_path))
+        if calibration[0] is None:
+            raise ValueError("No valid coordinates found to calibrate against.")
+
+    def normalized_batches():
+        for batch in iterCoordinateBatches(log_file_path):
+            yield normalizeCoordinates(batch, new_range, calibration)[0]
+
+    if use_cache:
+        try:
+            saveCachedBatches(log_file_path, normalized_batches(), new_range, previous_range, calibration)
+            cached = loadCachedTable(log_file_path, new_range, previous_range)
+            if cached is not None:
+                return cached
+        except OSError as e:
+            print(f"Could not write the replay cache for {log_file_path}: {e}")
+    return concatCoordinateTables(normalized_batches()), calibration
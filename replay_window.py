@@ -0,0 +1,103 @@
+import numpy as np
+
+from coordinate_extractor import CoordinateTable
+
+
+class ReplayWindow:
+    """
+    Time-indexed sliding window over coordinate data for replaying a log.
+
+    Rows are kept in one array sorted by timestamp and the window is just a pair of cursors,
+    so dropping stale rows and selecting the rows of a frame are binary searches over the
+    timestamp column instead of repeated deletions from the front of a list. The cost of a
+    frame therefore depends on the size of the window, not on how much of the log is left.
+    """
+    def __init__(self, coordinate_data, max_age=1.5):
+        """
+        :param coordinate_data: A CoordinateTable or a list of rows in the getCoordinateData layout.
+                                Rows must have a valid timestamp (e.g. the output of stretchData).
+        :param max_age: Rows older than this many seconds (in log time) are dropped from the window.
+        """
+        if isinstance(coordinate_data, CoordinateTable):
+            timestamps = coordinate_data.timestamps
+        else:
+            timestamps = np.array([float(row[6]) for row in coordinate_data], dtype=np.float64)
+
+        # Logs are mostly, but not always, in timestamp order
+        if np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind='stable')
+            if isinstance(coordinate_data, CoordinateTable):
+                coordinate_data = coordinate_data.take(order)
+            else:
+                coordinate_data = [coordinate_data[i] for i in order]
+            timestamps = timestamps[order]
+
+        self.data = coordinate_data
+        self.timestamps = timestamps
+        self.max_age = max_age
+        self.start = 0  # Index of the oldest row still in the window
+        self.delivered = 0  # Number of rows returned by new_rows so far
+
+    def advance(self, coordinate_time):
+        """
+        Moves the start of the window forward, dropping rows more than max_age seconds
+        older than coordinate_time. The window never moves backwards.
+        """
+        start = int(np.searchsorted(self.timestamps, coordinate_time - self.max_age, side='left'))
+        if start > self.start:
+            self.start = start
+        return self.start
+
+    def frame(self, coordinate_time):
+        """
+        Returns the rows in the window up to and including coordinate_time. A CoordinateTable
+        is sliced without copying; a list of rows is sliced normally.
+        """
+        end = int(np.searchsorted(self.timestamps, coordinate_time, side='right'))
+        return self.data[self.start:max(end, self.start)]
+
+    def new_rows(self, coordinate_time):
+        """
+        Returns the rows up to and including coordinate_time that earlier calls have not returned,
+        e.g. to feed each report to a KinematicsTracker exactly once.
+        """
+        end = max(int(np.searchsorted(self.timestamps, coordinate_time, side='right')), self.delivered)
+        rows = self.data[self.delivered:end]
+        self.delivered = end
+        return rows
+
+    def remaining(self):
+        """Returns the number of rows that have not been dropped from the window yet."""
+        return len(self.timestamps) - self.start
+
+    def first_timestamp(self):
+        return float(self.timestamps[0]) if len(self.timestamps) else None
+
+
+class VirtualClock:
+    """
+    Log-time clock for offline rendering. Frame i is at exactly start + i / fps, so the frames
+    of a replay do not depend on how long each one takes to render.
+    """
+    def __init__(self, start, fps, frame_index=0):
+        """
+        :param start: Log time of the first frame.
+        :param fps: Frames per second of the output video.
+        :param frame_index: Index of the frame to start at.
+        """
+        self.start = start
+        self.fps = fps
+        self.frame_index = frame_index
+
+    def frame_time(self, frame_index):
+        # Computed from the index rather than accumulated, so there is no rounding drift
+        return self.start + frame_index / self.fps
+
+    def time(self):
+        """Returns the log time of the current frame."""
+        return self.frame_time(self.frame_index)
+
+    def tick(self):
+        """Moves to the next frame and returns its log time."""
+        self.frame_index += 1
+        return self.time()
@@ -1,5 +1,6 @@
 import matplotlib.pyplot as plt
 import numpy as np
+from polygon_set import PolygonSet
 
 class Geofence:
     def __init__(self, quadrilaterals: list, colour: str):
@@ -16,6 +17,24 @@ class Geofence:
         # Validate the provided quadrilaterals
         self.validate_quadrilaterals()
 
+        # Compile the quadrilaterals once for the alarm checks
+        self.polygons = PolygonSet(self.quadrilaterals)
+
+    def contains(self, x, y):
+        """
+        Checks if (x, y) is inside any of the quadrilaterals.
+        """
+        return self.polygons.contains_point(x, y)
+
+    def contains_points(self, points):
+        """
+        Checks many points at once.
+
+        :param points: Array-like of shape (N, 2) with the X, Y of each point.
+        :return: Boolean array of shape (N,), True where the point is inside any quadrilateral.
+        """
+        return self.polygons.contains_any(points)
+
     def validate_quadrilaterals(self):
         """
         Validates that each quadrilateral in the list is a valid quadrilateral.
@@ -0,0 +1,69 @@
+import math
+
+
+class UniformGrid:
+    """
+    Uniform grid of square cells over the X, Y plane for "who is within radius r" queries.
+
+    Points are bucketed by cell, so a query only looks at the cells overlapping the query
+    circle instead of at every point. Rebuilding the grid is O(n), which makes it cheap to
+    refill on every tick.
+    """
+    def __init__(self, cell_size):
+        """
+        :param cell_size: Width of a cell in metres. Queries are cheapest when it is close to the query radius.
+        """
+        if cell_size <= 0:
+            raise ValueError("Cell size must be positive.")
+        self.cell_size = cell_size
+        self.cells = {}
+        self.points = {}
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def clear(self):
+        self.cells.clear()
+        self.points.clear()
+
+    def insert(self, key, x, y):
+        """Adds a point under key. A key that is already present is moved."""
+        if key in self.points:
+            self.remove(key)
+        self.points[key] = (x, y)
+        self.cells.setdefault(self._cell(x, y), []).append(key)
+
+    def remove(self, key):
+        x, y = self.points.pop(key)
+        cell = self._cell(x, y)
+        members = self.cells[cell]
+        members.remove(key)
+        if not members:
+            del self.cells[cell]
+
+    def query(self, x, y, radius):
+        """
+        Returns the keys of all points strictly closer than radius to (x, y), in no particular order.
+        Distances are computed exactly as AlarmManager.check_proximity does.
+        """
+        if not self.points or radius <= 0:
+            return []
+
+        low_x, low_y = self._cell(x - radius, y - radius)
+        high_x, high_y = self._cell(x + radius, y + radius)
+        if (high_x - low_x + 1) * (high_y - low_y + 1) > len(self.cells):
+            # The circle covers more cells than are occupied, so visit the occupied ones
+            candidates = (key for members in self.cells.values() for key in members)
+        else:
+            candidates = (key for cell_x in range(low_x, high_x + 1) for cell_y in range(low_y, high_y + 1)
+                          for key in self.cells.get((cell_x, cell_y), ()))
+
+        found = []
+        for key in candidates:
+            point_x, point_y = self.points[key]
+            if ((x - point_x) ** 2 + (y - point_y) ** 2) ** 0.5 < radius:
+                found.append(key)
+        return found
+
+    def __len__(self):
+        return len(self.points)
@@ -1,6 +1,8 @@
 import time
 
 class Tag:
+    __slots__ = ('tag_type', 'tag_id', 'battery', 'location', 'timestamp')
+
     def __init__(self, tag_type: str, tag_id: str, battery: float, location: tuple, timestamp: float = None):
         """
         Initializes the Tag object with type, ID, battery percentage, location, and timestamp.
@@ -1,14 +1,68 @@
 import json
+import os
+import stat
+import tempfile
 import threading
 import time
+from collections import namedtuple
 from pathlib import Path
+from types import MappingProxyType
+
+from tag_registry import TagRegistry
+
+# Immutable view of the TagManager data at one version. settings is a read-only mapping, tags a
+# TagTable (readable as arrays or as a mapping) and alerts a tuple; the per-alert dicts are shared
+# and must not be modified.
+TagSnapshot = namedtuple('TagSnapshot', ['version', 'settings', 'tags', 'alerts'])
+
+def getSnapshotSequenceData(snapshot, sequence_data):
+    """
+    In-memory equivalent of main.getFullSequenceData, reading the tags from a TagManager snapshot
+    and the geofence zones from already loaded sequence data instead of re-reading both files.
+
+    Parameters:
+    - snapshot (TagSnapshot): Snapshot returned by TagManager.snapshot().
+    - sequence_data (dict): Contents of sequence_data.json.
+
+    Returns:
+    - The same (sequence_name, tags, cranes, geofence_zones) tuple as main.getFullSequenceData.
+    """
+    sequence_name = snapshot.settings['selected_sequence']
+    tags = snapshot.tags
+
+    # Filter out crane tags (where tag_type is "Crane"); only their entries are built
+    cranes = [tags[tags.tag_id(row)] for row in tags.rows_of_type("Crane").tolist()]
+
+    # Extract geofence zones for the selected sequence
+    geofence_zones = sequence_data['sequence'].get(sequence_name, {}).get('quadrilaterals', [])
+
+    return sequence_name, tags, cranes, geofence_zones
 
 class TagManager:
-    def __init__(self, file_path):
+    def __init__(self, file_path, flush_interval=0.1, auto_flush=True):
+        """
+        :param file_path: Path to the JSON file shared with the web application (data.json).
+        :param flush_interval: Seconds to wait after a change before writing the file, so that all changes
+                               made in the meantime are written together. None or 0 writes on every change.
+        :param auto_flush: Write changes on their own as above. When False, changes are only marked and
+                           are written when the owner calls flush(), e.g. from a persistence stage.
+        """
         self.file_path = Path(file_path)
         self.data = self.load_data()
-        self.lock = threading.Lock()
+        # The current state of the tags lives in the registry; snapshots copy its columns, and
+        # self.data['tags'] is only brought up to date from it (see sync_tags) when the data is written
+        self.registry = TagRegistry()
+        self.registry.load(self.data.get('tags', {}))
+        self.lock = threading.RLock()  # Guards self.data
+        self.write_lock = threading.Lock()  # Keeps writes to the file in order
+        self.flush_interval = flush_interval
+        self.auto_flush = auto_flush
         self.last_save_time = time.time()
+        self.dirty = False
+        self.flush_timer = None
+        self.version = 0  # Incremented on every change to self.data
+        self.snapshot_cache = None
+        self.file_stamp = self._stat_file()  # (mtime, size) of the file as last read or written by us
         if not self.file_path.exists():
             self.save_data()  # Ensure the file is created if it doesn't exist
 
@@ -23,40 +77,155 @@ class TagManager:
             return {"settings": {}, "tags": {}, "alerts": []}
 
     def save_data(self):
-        with self.lock:
+        """
+        Writes the data to the file immediately. The file is written to a temporary file first and then
+        renamed over the original, so a reader (such as the web application) never sees a half-written file.
+        """
+        with self.write_lock:
+            with self.lock:
+                self.dirty = False
+                self.sync_tags()
+                contents = json.dumps(self.data, indent=4)
+            temp_path = None
             try:
-                with open(self.file_path, 'w') as file:
-                    json.dump(self.data, file, indent=4)
+                with tempfile.NamedTemporaryFile('w', dir=self.file_path.parent, prefix=f".{self.file_path.name}.",
+                                                 suffix='.tmp', delete=False) as file:
+                    temp_path = file.name
+                    file.write(contents)
+                # The temporary file is only readable by us; keep the permissions of the file it replaces
+                try:
+                    mode = stat.S_IMODE(os.stat(self.file_path).st_mode)
+                except FileNotFoundError:
+                    mode = 0o644
+                os.chmod(temp_path, mode)
+                os.replace(temp_path, self.file_path)
+                self.file_stamp = self._stat_file()
             except Exception as e:
                 print(f"Failed to save data: {e}")
+                with self.lock:
+                    self.dirty = True  # Write the changes again on the next flush
+                if temp_path is not None and os.path.exists(temp_path):
+                    os.remove(temp_path)
+            self.last_save_time = time.time()
 
-    def add_or_update_tag(self, tag):
-        #with self.lock: # Temporarily comment out - might be so temporary
-            self.data['tags'][tag.get_tag_id()] = {
-                'tag_type': tag.get_tag_type(),
-                'battery': tag.get_battery(),
-                'location': tag.get_location(),
-                'timestamp': tag.get_timestamp()
-            }
-            # Force immediate save for testing
+    def _stat_file(self):
+        try:
+            stat = self.file_path.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def snapshot(self):
+        """
+        Returns an immutable TagSnapshot of the current data. Snapshots are cached per version, so
+        repeated calls between changes return the same object, and holding one requires no lock.
+        """
+        snapshot = self.snapshot_cache
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+        with self.lock:
+            # Alert entries are replaced rather than modified, so copying the containers is enough
+            snapshot = TagSnapshot(
+                version=self.version,
+                settings=MappingProxyType(dict(self.data.get('settings', {}))),
+                tags=self.registry.table(),
+                alerts=tuple(self.data.get('alerts', []))
+            )
+            self.snapshot_cache = snapshot
+        return snapshot
+
+    def reload_if_changed(self):
+        """
+        Picks up changes that another process (the web application) has written to the file since we
+        last read or wrote it. Only the settings are taken from the file; tags and alerts are owned by
+        this process. Returns True if the settings were reloaded.
+        """
+        stamp = self._stat_file()
+        if stamp is None or stamp == self.file_stamp:
+            return False
+        with self.write_lock:
+            external = self.load_data()
+            with self.lock:
+                self.file_stamp = stamp
+                if external.get('settings', {}) == self.data.get('settings', {}):
+                    return False
+                self.data['settings'] = external.get('settings', {})
+                self.version += 1
+        return True
+
+    def mark_dirty(self):
+        """
+        Records that the data has changed and schedules a write after flush_interval, unless
+        auto_flush is off. Further changes before the write are coalesced into it.
+        """
+        with self.lock:
+            self.version += 1
+            if not self.auto_flush:
+                self.dirty = True
+                return
+        if not self.flush_interval:
+            self.save_data()
+            return
+        with self.lock:
+            self.dirty = True
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def _flush_from_timer(self):
+        with self.lock:
+            self.flush_timer = None
+        self.flush()
+
+    def flush(self):
+        """Writes any pending changes now. Call this before exiting so no changes are lost."""
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            dirty = self.dirty
+        if dirty:
             self.save_data()
-            #current_time = time.time()
-            #if current_time - self.last_save_time >= 0.1:
-            #    self.save_data()
-            #    self.last_save_time = current_time
-            
+
+    def sync_tags(self):
+        """Replaces the entries in self.data['tags'] of the tags changed in the registry since the last sync."""
+        with self.lock:
+            tags = self.data.setdefault('tags', {})
+            for tag_id in self.registry.take_dirty():
+                tags[tag_id] = self.registry.to_dict(tag_id)
+
+    def add_or_update_tag(self, tag):
+        with self.lock:
+            self.registry.set_tag(tag.get_tag_id(), tag.get_tag_type(), tag.get_battery(), tag.get_location(),
+                                  tag.get_timestamp())
+        self.mark_dirty()
+
+    def update_tag_positions(self, tag_ids, x, y, z, timestamps, battery=None):
+        """
+        Updates the location and timestamp of several tags in one change, without creating Tag objects.
+        Tags that are not registered yet are added with no type. See TagRegistry.update_positions.
+        """
+        if len(tag_ids) == 0:
+            return
+        with self.lock:
+            self.registry.update_positions(tag_ids, x, y, z, timestamps, battery)
+        self.mark_dirty()
+
     def update_settings(self, selected_data_set=None, selected_sequence=None):
-        if selected_data_set is not None:
-            self.data['settings']['selected_data_set'] = selected_data_set
-        if selected_sequence is not None:
-            self.data['settings']['selected_sequence'] = selected_sequence
-        self.save_data()
+        with self.lock:
+            if selected_data_set is not None:
+                self.data['settings']['selected_data_set'] = selected_data_set
+            if selected_sequence is not None:
+                self.data['settings']['selected_sequence'] = selected_sequence
+        self.mark_dirty()
     
     def get_tag_type(self, serial_number):
         """Retrieve the tag type for a given serial number."""
-        return self.data['tags'].get(serial_number, {}).get('tag_type', None)
+        return self.registry.tag_type(serial_number)
     
     def add_alert(self, tag_id, alert_name, alert_message, timestamp):
+        with self.lock:
             # Ensure 'alerts' key exists
             if 'alerts' not in self.data:
                 self.data['alerts'] = []
@@ -66,30 +235,35 @@ class TagManager:
                 "message": alert_message,
                 "timestamp": timestamp
             })
-            self.save_data()
+        self.mark_dirty()
     
     def purge_old_alerts(self):
-        # Sort the alerts by timestamp in descending order
-        self.data['alerts'].sort(key=lambda x: x['timestamp'], reverse=True)
-        # Keep only the 10 most recent
-        self.data['alerts'] = self.data['alerts'][:10]
+        with self.lock:
+            # Sort the alerts by timestamp in descending order
+            self.data['alerts'].sort(key=lambda x: x['timestamp'], reverse=True)
+            # Keep only the 10 most recent
+            self.data['alerts'] = self.data['alerts'][:10]
+            self.version += 1
 
     def remove_alerts(self):
-        #with self.lock:
+        with self.lock:
             self.data['alerts'] = []
-            self.save_data()
+        self.mark_dirty()
 
     def remove_alert(self, tag_id, alert_name):
-        # Removes specific alerts from the JSON data
-        self.data['alerts'] = [alert for alert in self.data['alerts']
-                               if not (alert['tag_id'] == tag_id and alert['name'] == alert_name)]
-        self.save_data()
+        with self.lock:
+            # Removes specific alerts from the JSON data
+            self.data['alerts'] = [alert for alert in self.data['alerts']
+                                   if not (alert['tag_id'] == tag_id and alert['name'] == alert_name)]
+        self.mark_dirty()
     
     def remove_tags(self):
         """
         Removes all tags from the JSON file.
         """
-        # Clear the 'tags' dictionary
-        self.data['tags'] = {}
+        with self.lock:
+            # Clear the 'tags' dictionary
+            self.data['tags'] = {}
+            self.registry.clear()
         # Save the updated data to the file
-        self.save_data()
\ No newline at end of file
+        self.mark_dirty()
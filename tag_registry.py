@@ -0,0 +1,222 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+from coordinate_extractor import StringIndex
+
+
+def _entry(tag_type, battery, location, timestamp):
+    # One tag in the data.json 'tags' layout, from the values of its registry columns
+    battery = battery.item()
+    if battery.is_integer():
+        battery = int(battery)  # Whole percentages are written as integers, as they always have been
+    elif battery != battery:
+        battery = None
+    timestamp = timestamp.item()
+    return {
+        'tag_type': tag_type,
+        'battery': battery,
+        # A tag registered without a location has a row of NaN, written as null like before
+        'location': tuple(location.tolist()) if not np.isnan(location).all() else None,
+        'timestamp': timestamp if timestamp == timestamp else None
+    }
+
+
+class TagRegistry:
+    """
+    Current state of every tag in preallocated NumPy columns.
+
+    Each tag ID gets a row the first time it is seen; the type is stored as a code, and the
+    battery, position and timestamp as float columns, so updating a tag writes into the arrays
+    instead of allocating a Tag and a dict, and alarms and rendering can read every position at
+    once. A dirty bitmap marks the rows changed since the last take_dirty(), and each row records
+    the registry version it last changed at, so any number of readers can ask what changed
+    since they last looked (see table and TagTable.changed_since).
+    """
+    def __init__(self, capacity=16):
+        """
+        :param capacity: Number of tags to allocate room for. The columns grow as needed.
+        """
+        self.ids = StringIndex()  # Tag ID -> row
+        self.types = StringIndex()  # Tag type -> code; None is a valid type
+        self.type_codes = np.zeros(capacity, dtype=np.int16)
+        self.battery = np.full(capacity, np.nan)
+        self.positions = np.full((capacity, 3), np.nan)  # x, y, z
+        self.timestamps = np.full(capacity, np.nan)
+        self.dirty = np.zeros(capacity, dtype=bool)
+        self.changed = np.zeros(capacity, dtype=np.int64)  # Version each row last changed at
+        self.version = 0
+        # Replaced when the registry is cleared, so tables taken before and after can tell their rows apart
+        self.epoch = object()
+
+    def _grow(self, size):
+        capacity = len(self.dirty)
+        if size <= capacity:
+            return
+        grow = max(size, 2 * capacity) - capacity
+        self.type_codes = np.concatenate([self.type_codes, np.zeros(grow, dtype=np.int16)])
+        self.battery = np.concatenate([self.battery, np.full(grow, np.nan)])
+        self.positions = np.concatenate([self.positions, np.full((grow, 3), np.nan)])
+        self.timestamps = np.concatenate([self.timestamps, np.full(grow, np.nan)])
+        self.dirty = np.concatenate([self.dirty, np.zeros(grow, dtype=bool)])
+        self.changed = np.concatenate([self.changed, np.zeros(grow, dtype=np.int64)])
+
+    def _rows(self, tag_ids):
+        # Rows of the given tags, adding new tags with no type
+        new_type = self.types.code(None)
+        first_new = len(self.ids)
+        rows = np.array([self.ids.code(tag_id) for tag_id in tag_ids], dtype=np.int64)
+        if len(self.ids) > first_new:
+            self._grow(len(self.ids))
+            self.type_codes[first_new:len(self.ids)] = new_type
+        return rows
+
+    def _touch(self, rows):
+        self.version += 1
+        self.dirty[rows] = True
+        self.changed[rows] = self.version
+
+    def set_tag(self, tag_id, tag_type, battery, location, timestamp):
+        """Sets every field of a tag, adding it if it is new."""
+        row = self._rows([tag_id])
+        self.type_codes[row] = self.types.code(tag_type)
+        self.battery[row] = battery if battery is not None else np.nan
+        self.positions[row] = location if location is not None else (np.nan, np.nan, np.nan)
+        self.timestamps[row] = timestamp if timestamp is not None else np.nan
+        self._touch(row)
+
+    def update_positions(self, tag_ids, x, y, z, timestamps, battery=None):
+        """
+        Sets the position and timestamp of several tags at once. Tags that are not registered
+        yet are added with no type.
+
+        :param tag_ids: Tag IDs, each at most once.
+        :param x, y, z, timestamps: Sequences or arrays of the same length as tag_ids.
+        :param battery: Battery percentage to set for all of them, or None to leave it unchanged.
+        """
+        if len(tag_ids) == 0:
+            return
+        rows = self._rows(tag_ids)
+        self.positions[rows, 0] = x
+        self.positions[rows, 1] = y
+        self.positions[rows, 2] = z
+        self.timestamps[rows] = timestamps
+        if battery is not None:
+            self.battery[rows] = battery
+        self._touch(rows)
+
+    def load(self, tags):
+        """Adds the tags of a data.json 'tags' dict. They are not marked dirty."""
+        for tag_id, tag_info in tags.items():
+            self.set_tag(tag_id, tag_info.get('tag_type'), tag_info.get('battery'), tag_info.get('location'),
+                         tag_info.get('timestamp'))
+        self.dirty[:] = False
+
+    def tag_type(self, tag_id):
+        row = self.ids.codes.get(tag_id)
+        return self.types.value(self.type_codes[row]) if row is not None else None
+
+    def to_dict(self, tag_id):
+        """Returns the entry of a tag in the data.json 'tags' layout."""
+        row = self.ids.codes[tag_id]
+        return _entry(self.types.value(self.type_codes[row]), self.battery[row], self.positions[row],
+                      self.timestamps[row])
+
+    def take_dirty(self):
+        """Returns the IDs of the tags changed since the last call, in row order, and clears the dirty bitmap."""
+        rows = np.flatnonzero(self.dirty[:len(self.ids)])
+        self.dirty[rows] = False
+        return [self.ids.value(row) for row in rows.tolist()]
+
+    def table(self):
+        """Returns a TagTable of the current state of every tag."""
+        return TagTable(self)
+
+    def clear(self):
+        """Removes every tag. The version keeps counting up, so changed_since still works across a clear."""
+        version = self.version
+        self.__init__(len(self.dirty))
+        self.version = version + 1
+
+    def __contains__(self, tag_id):
+        return tag_id in self.ids.codes
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class TagTable(Mapping):
+    """
+    Read-only copy of a TagRegistry at one version.
+
+    The columns are copied in one go, so the alarm checks can read the type and position of
+    every tag as arrays, in row order (the order the tags were first registered in, which is
+    also their order in data.json). The table is also a mapping of tag ID to its data.json
+    'tags' entry for code that wants dicts; an entry is only built when it is looked up.
+    """
+    def __init__(self, registry):
+        size = len(registry)
+        self.epoch = registry.epoch
+        self.version = registry.version
+        # The indexes only ever grow until the registry is cleared, which replaces them, so they can be
+        # shared: rows at or past size were added after the copy and are ignored
+        self.ids = registry.ids
+        self.types = registry.types
+        self.size = size
+        self.type_codes = registry.type_codes[:size].copy()
+        self.battery = registry.battery[:size].copy()
+        self.positions = registry.positions[:size].copy()
+        self.timestamps = registry.timestamps[:size].copy()
+        self.changed = registry.changed[:size].copy()
+
+    @classmethod
+    def from_dict(cls, tags):
+        """Builds a table from a dict in the data.json 'tags' layout, e.g. from main.getFullSequenceData."""
+        registry = TagRegistry(max(len(tags), 1))
+        registry.load(tags)
+        return cls(registry)
+
+    def row(self, tag_id):
+        """Returns the row of a tag, or None if it is not in the table."""
+        row = self.ids.codes.get(tag_id)
+        return row if row is not None and row < self.size else None
+
+    def tag_id(self, row):
+        return self.ids.value(row)
+
+    def tag_type(self, row):
+        return self.types.value(self.type_codes[row])
+
+    def type_code(self, tag_type):
+        """Returns the code of a tag type in type_codes, or -1 if no tag has ever had that type."""
+        return self.types.codes.get(tag_type, -1)
+
+    def rows_of_type(self, *tag_types):
+        """Returns the rows of the tags of the given types, in row order."""
+        return np.flatnonzero(np.isin(self.type_codes, [self.type_code(tag_type) for tag_type in tag_types]))
+
+    def changed_since(self, version):
+        """Returns the rows of the tags changed after the given registry version, in row order."""
+        return np.flatnonzero(self.changed > version)
+
+    def columns(self, rows):
+        """Returns the tag IDs, types and (x, y) positions of the given rows as three lists."""
+        rows = np.asarray(rows, dtype=np.int64)
+        ids, types = self.ids.values, self.types.values
+        return ([ids[row] for row in rows.tolist()], [types[code] for code in self.type_codes[rows].tolist()],
+                self.positions[rows, :2].tolist())
+
+    def __getitem__(self, tag_id):
+        row = self.row(tag_id)
+        if row is None:
+            raise KeyError(tag_id)
+        return _entry(self.tag_type(row), self.battery[row], self.positions[row], self.timestamps[row])
+
+    def __iter__(self):
+        return (self.ids.value(row) for row in range(self.size))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, tag_id):
+        return self.row(tag_id) is not None
@@ -1,75 +1,183 @@
 import csv
-import math
+import itertools
 
-def exportVelocity(coordinate_data, file_path):
+import numpy as np
+
+from coordinate_extractor import CoordinateTable
+
+# Velocities above this are treated as positioning glitches and skipped
+MAX_VELOCITY_KMPH = 180
+
+def _parseColumns(coordinate_data):
     """
-    Exports velocity data from coordinate_data to a CSV file.
-    
-    Args:
-    coordinate_data (list of lists): Data outputted from getCoordinateData.
-    file_path (str): Path to the CSV file to export data.
+    Returns (tag_ids, tag_codes, x, y, z, timestamps, valid, plain_timestamps) for coordinate_data.
 
-    The function calculates velocity in km/h for each tag and skips invalid data points.
-    The time in the CSV will be in seconds since the earliest time step.
+    valid marks the rows whose X, Y, Z and timestamp all convert with float(), and plain_timestamps
+    the rows whose timestamp string is a plain unsigned decimal number (the rows exportVelocity
+    has always used to find the earliest time).
     """
-    invalid_data_count = 0
-    total_data_count = 0
-    valid_data = []
+    if isinstance(coordinate_data, CoordinateTable):
+        records = coordinate_data.records
+        x, y, z, timestamps = records['x'], records['y'], records['z'], records['timestamp']
+        # A CoordinateTable stores unparsable fields as NaN
+        valid = ~(np.isnan(x) | np.isnan(y) | np.isnan(z) | np.isnan(timestamps))
+        # Timestamps whose repr() is a plain decimal number, without a sign or an exponent
+        with np.errstate(invalid='ignore'):
+            plain_timestamps = (np.isfinite(timestamps) & ~np.signbit(timestamps) & (timestamps < 1e16) &
+                                ((timestamps == 0) | (timestamps >= 1e-4)))
+        return coordinate_data.tags.values, records['tag'], x, y, z, timestamps, valid, plain_timestamps
 
-    # Dictionary to store previous coordinates and time for each tag
-    previous_data = {}
+    tag_codes = {}
+    codes = np.empty(len(coordinate_data), dtype=np.int64)
+    positions = np.full((len(coordinate_data), 3), np.nan)
+    timestamps = np.full(len(coordinate_data), np.nan)
+    valid = np.zeros(len(coordinate_data), dtype=bool)
+    plain_timestamps = np.zeros(len(coordinate_data), dtype=bool)
+    for i, data_point in enumerate(coordinate_data):
+        codes[i] = tag_codes.setdefault(data_point[1], len(tag_codes))
+        if data_point[6].replace('.', '', 1).isdigit():
+            plain_timestamps[i] = True
+            timestamps[i] = float(data_point[6])
+        try:
+            positions[i] = (float(data_point[2]), float(data_point[3]), float(data_point[4]))
+            timestamps[i] = float(data_point[6])
+            valid[i] = True
+        except (ValueError, IndexError):
+            pass
+    return list(tag_codes), codes, positions[:, 0], positions[:, 1], positions[:, 2], timestamps, valid, plain_timestamps
+
+def getVelocityData(coordinate_data):
+    """
+    Calculates the velocity of each tag between consecutive valid data points.
+
+    Args:
+    coordinate_data (CoordinateTable or list of lists): Data outputted from getCoordinateTable or getCoordinateData.
+
+    Returns:
+    tuple: (valid_data, invalid_data_count) where valid_data is a list of [Tag_ID, Timestamp_s, Velocity_kmph]
+           rows in the order of the data, with the time in seconds since the earliest time step.
+    """
+    tag_ids, codes, x, y, z, timestamps, valid, plain_timestamps = _parseColumns(coordinate_data)
 
     # Find the earliest timestamp in the data
-    valid_timestamps = [float(data_point[6]) for data_point in coordinate_data if data_point[6].replace('.', '', 1).isdigit()]
-    if not valid_timestamps:
+    if not plain_timestamps.any():
         raise ValueError("No valid timestamps found in coordinate_data.")
-    
-    earliest_time = min(valid_timestamps)
+    earliest_time = timestamps[plain_timestamps].min()
 
-    for data_point in coordinate_data:
-        total_data_count += 1
-        tag_id = data_point[1]
-        try:
-            # Ensure valid data for positions and timestamps
-            x = float(data_point[2])
-            y = float(data_point[3])
-            z = float(data_point[4])
-            timestamp = float(data_point[6])
+    current, velocity_kmh = _pairVelocities(codes, x, y, z, timestamps, np.flatnonzero(valid))
 
-            # Adjust time to be in seconds since the earliest timestamp
-            relative_time = timestamp - earliest_time
+    relative_time = timestamps[current] - earliest_time
+    valid_data = [[tag_ids[code], time, velocity]
+                  for code, time, velocity in zip(codes[current].tolist(), relative_time.tolist(), velocity_kmh.tolist())]
+    return valid_data, len(valid) - int(valid.sum())
 
-            # Check if this tag has previous data to calculate velocity
-            if tag_id in previous_data:
-                prev_x, prev_y, prev_z, prev_timestamp = previous_data[tag_id]
-                time_diff = timestamp - prev_timestamp
+def _pairVelocities(codes, x, y, z, timestamps, points):
+    """
+    Pairs every valid data point in points (indexes in data order) with the previous one of the
+    same tag and returns (current, velocity_kmh) for the pairs that are kept, ordered by current.
+    """
+    # Pair every valid data point with the previous valid one of the same tag, keeping the data order
+    points = points[np.argsort(codes[points], kind='stable')]
+    same_tag = codes[points[1:]] == codes[points[:-1]]
+    current, previous = points[1:][same_tag], points[:-1][same_tag]
 
-                # Skip if time difference is 0 to avoid division by zero
-                if time_diff > 0:
-                    # Calculate distance in meters
-                    distance = math.sqrt((x - prev_x)**2 + (y - prev_y)**2 + (z - prev_z)**2)
+    # Skip pairs with no time difference to avoid division by zero
+    time_diff = timestamps[current] - timestamps[previous]
+    moving = time_diff > 0
+    current, previous, time_diff = current[moving], previous[moving], time_diff[moving]
 
-                    # Convert velocity from m/s to km/h
-                    velocity_kmh = (distance / time_diff) * 3.6
+    # Calculate distance in meters and convert velocity from m/s to km/h. float_power calls pow()
+    # like Python's ** does, where ** on an array multiplies, so the results match to the last bit.
+    distance = np.sqrt(np.float_power(x[current] - x[previous], 2) + np.float_power(y[current] - y[previous], 2) +
+                       np.float_power(z[current] - z[previous], 2))
+    velocity_kmh = (distance / time_diff) * 3.6
 
-                    # Skip absurd velocities (> 180 km/h)
-                    if velocity_kmh <= 180:
-                        # Correct the order: first timestamp, then velocity
-                        valid_data.append([tag_id, relative_time, velocity_kmh])
+    # Skip absurd velocities
+    plausible = velocity_kmh <= MAX_VELOCITY_KMPH
+    current, velocity_kmh = current[plausible], velocity_kmh[plausible]
+    order = np.argsort(current, kind='stable')
+    return current[order], velocity_kmh[order]
 
-            # Update previous data for this tag
-            previous_data[tag_id] = (x, y, z, timestamp)
+def iterVelocityData(coordinate_table, batch_size=65536):
+    """
+    getVelocityData for a CoordinateTable, computed batch_size rows at a time so the working
+    arrays stay the same size however long the table is (e.g. a memory-mapped replay cache).
 
-        except (ValueError, IndexError):
-            # Count invalid data points (missing or malformed entries)
-            invalid_data_count += 1
-            continue
+    The last valid data point of every tag is carried over to the next batch, so the rows, and
+    the order they come in, are exactly those of getVelocityData.
+
+    Args:
+    coordinate_table (CoordinateTable): Data outputted from getCoordinateTable or getNormalizedTable.
+    batch_size (int): Number of rows to process at a time.
+
+    Yields:
+    tuple: (valid_data, invalid_data_count) for each batch, as returned by getVelocityData.
+    """
+    # The times are relative to the earliest one, so that is found first
+    earliest_time = None
+    for start in range(0, len(coordinate_table), batch_size):
+        _, _, _, _, _, timestamps, _, plain_timestamps = _parseColumns(coordinate_table[start:start + batch_size])
+        if plain_timestamps.any():
+            batch_earliest = timestamps[plain_timestamps].min()
+            earliest_time = batch_earliest if earliest_time is None else min(earliest_time, batch_earliest)
+    if earliest_time is None:
+        raise ValueError("No valid timestamps found in coordinate_data.")
+
+    last_points = {}  # Tag code -> (code, x, y, z, timestamp) of its last valid data point so far
+    for start in range(0, len(coordinate_table), batch_size):
+        tag_ids, codes, x, y, z, timestamps, valid, _ = _parseColumns(coordinate_table[start:start + batch_size])
+
+        # Put the carried over points in front of the batch; they come before it in the data
+        carried = len(last_points)
+        if carried:
+            carried_codes, carried_x, carried_y, carried_z, carried_timestamps = (np.array(column) for column in
+                                                                                  zip(*last_points.values()))
+            codes = np.concatenate([carried_codes.astype(codes.dtype), codes])
+            x, y, z = np.concatenate([carried_x, x]), np.concatenate([carried_y, y]), np.concatenate([carried_z, z])
+            timestamps = np.concatenate([carried_timestamps, timestamps])
+        points = np.concatenate([np.arange(carried), carried + np.flatnonzero(valid)])
+
+        current, velocity_kmh = _pairVelocities(codes, x, y, z, timestamps, points)
+
+        # Remember the last valid point of every tag in the batch
+        batch_points = points[carried:]
+        _, last = np.unique(codes[batch_points][::-1], return_index=True)
+        for point in batch_points[len(batch_points) - 1 - last].tolist():
+            last_points[int(codes[point])] = (codes[point], x[point], y[point], z[point], timestamps[point])
+
+        relative_time = timestamps[current] - earliest_time
+        valid_data = [[tag_ids[code], time, velocity] for code, time, velocity in
+                      zip(codes[current].tolist(), relative_time.tolist(), velocity_kmh.tolist())]
+        yield valid_data, len(valid) - int(valid.sum())
+
+def exportVelocity(coordinate_data, file_path):
+    """
+    Exports velocity data from coordinate_data to a CSV file.
+    
+    Args:
+    coordinate_data (CoordinateTable or list of lists): Data outputted from getCoordinateTable or getCoordinateData.
+    file_path (str): Path to the CSV file to export data.
+
+    The function calculates velocity in km/h for each tag and skips invalid data points.
+    The time in the CSV will be in seconds since the earliest time step. A CoordinateTable is
+    processed and written in batches (see iterVelocityData).
+    """
+    if isinstance(coordinate_data, CoordinateTable):
+        batches = iterVelocityData(coordinate_data)
+    else:
+        batches = iter([getVelocityData(coordinate_data)])
+    # Compute the first batch before creating the file, so invalid data leaves no empty CSV behind
+    first_batch = next(batches, ([], 0))
+    total_data_count = len(coordinate_data)
+    invalid_data_count = 0
 
     # Write valid data to CSV
     with open(file_path, 'w', newline='') as csvfile:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerow(['Tag_ID', 'Timestamp_s', 'Velocity_kmph'])
-        csvwriter.writerows(valid_data)
+        for valid_data, batch_invalid_count in itertools.chain([first_batch], batches):
+            csvwriter.writerows(valid_data)
+            invalid_data_count += batch_invalid_count
 
     # Calculate and print the invalid data rate
     invalid_data_rate = (invalid_data_count / total_data_count) * 100
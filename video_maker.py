@@ -1,26 +1,133 @@
 import cv2
 import time
+import queue
+import threading
 import numpy as np
 import matplotlib.pyplot as plt
-from PIL import Image
-import io
-
-def convert_plot_to_frame():
-    # Save the current plot to a bytes buffer
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')  # Save current Matplotlib plot to the buffer
-    buf.seek(0)
-    
-    # Open the image from the buffer
-    img = Image.open(buf)
-    
-    # Convert the image to a format suitable for video (e.g., BGR for OpenCV)
-    frame = np.array(img.convert('RGB'))  # Convert PIL image to RGB NumPy array
-    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)  # Convert RGB to BGR (OpenCV format)
-    return frame
+
+def fit_figure_to_frame(fig, frame_size):
+    """
+    Sizes a figure so that its canvas is exactly frame_size pixels and frames captured
+    from it can be written to the video without resizing.
+    :param fig: The Matplotlib figure.
+    :param frame_size: Video frame size (width, height) in pixels.
+    """
+    width, height = frame_size
+    fig.set_size_inches(width / fig.dpi, height / fig.dpi)
+
+def convert_plot_to_frame(fig=None, draw=True):
+    """
+    Captures the given (or current) figure as a BGR frame for OpenCV, straight from the
+    pixels of its Agg canvas.
+    :param fig: The Matplotlib figure. Defaults to the current figure.
+    :param draw: Draw the figure first. Pass False if the canvas is already up to date,
+                 e.g. right after CoordinatePlotter.render.
+    :return: A new (height, width, 3) uint8 array.
+    """
+    canvas = (fig if fig is not None else plt.gcf()).canvas
+    if draw:
+        canvas.draw()
+
+    # The RGBA buffer is read in place; converting it to BGR is the only copy made
+    rgba = np.asarray(canvas.buffer_rgba())
+    return cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGR)
 
 import cv2
 
+# What FrameEncoder does with a frame that arrives while its queue is full
+ENCODER_POLICIES = ('block', 'drop', 'duplicate')
+
+class FrameEncoder:
+    """
+    Writes frames to a VideoWriterState on a background thread.
+
+    Frames are handed over through a bounded queue, so encoding never holds up the thread that
+    renders them. When the encoder falls behind and the queue is full, the policy decides what
+    happens to a new frame:
+    - 'block': wait for space, so every frame is written (rendering slows to the encoding speed).
+    - 'drop': discard the frame; the video becomes shorter than real time.
+    - 'duplicate': discard the frame but fill its time slots by repeating the last frame written,
+      so the video still plays in real time.
+    """
+    def __init__(self, video_writer_state, queue_size=64, policy='duplicate'):
+        """
+        :param video_writer_state: The initialized VideoWriterState to write to.
+        :param queue_size: Maximum number of frames waiting to be encoded.
+        :param policy: One of ENCODER_POLICIES.
+        """
+        if policy not in ENCODER_POLICIES:
+            raise ValueError(f"Invalid policy: {policy}. Choose from {list(ENCODER_POLICIES)}.")
+        self.video_writer_state = video_writer_state
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.held_repeats = 0  # Time slots of dropped frames still to be filled with the last frame
+        self.frames_queued = 0
+        self.frames_dropped = 0
+        self.frames_written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='FrameEncoder', daemon=True)
+        self.thread.start()
+
+    def submit(self, frame, num_repeats=1, block=None):
+        """
+        Queues a frame to be written num_repeats times. The frame must not be modified afterwards.
+        :param block: Wait for space in the queue. Defaults to the policy.
+        :return: True if the frame was queued, False if it was dropped.
+        """
+        if self.error is not None:
+            raise RuntimeError("Video encoding failed.") from self.error
+
+        if block is None:
+            block = self.policy == 'block'
+        item = (frame, num_repeats, self.held_repeats if self.policy == 'duplicate' else 0)
+        try:
+            self.queue.put(item, block=block)
+        except queue.Full:
+            self.frames_dropped += 1
+            if self.policy == 'duplicate':
+                self.held_repeats += num_repeats
+            return False
+        self.held_repeats = 0
+        self.frames_queued += 1
+        return True
+
+    def _run(self):
+        last_frame = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # Keep emptying the queue so submit and close never block
+            frame, num_repeats, held_repeats = item
+            try:
+                writer = self.video_writer_state.video_writer
+                if last_frame is not None:
+                    for _ in range(held_repeats):
+                        writer.write(last_frame)
+                if frame is not None:
+                    frame = np.asarray(frame)
+                    if (frame.shape[1], frame.shape[0]) != tuple(self.video_writer_state.frame_size):
+                        frame = cv2.resize(frame, self.video_writer_state.frame_size)
+                    for _ in range(num_repeats):
+                        writer.write(frame)
+                    last_frame = frame
+                    self.frames_written += 1
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """Writes every queued frame, then stops the thread."""
+        if self.thread.is_alive():
+            if self.held_repeats:
+                # Fill the slots of frames dropped at the end with the last frame
+                self.queue.put((None, 0, self.held_repeats))
+                self.held_repeats = 0
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise RuntimeError("Video encoding failed.") from self.error
+
 class VideoWriterState:
     def __init__(self, output_file, codec, fps, frame_size=None):
         """
@@ -35,6 +142,7 @@ class VideoWriterState:
         self.fps = fps
         self.frame_size = frame_size
         self.video_writer = None
+        self.encoder = None  # FrameEncoder, if frames are encoded in the background
         self.last_frame_time = None  # Track when the last frame was added
     
     def initialize_writer(self):
@@ -49,27 +157,53 @@ class VideoWriterState:
         fourcc = cv2.VideoWriter_fourcc(*self.codec)  # Codec, e.g., 'XVID' or 'mp4v'
         self.video_writer = cv2.VideoWriter(self.output_file, fourcc, self.fps, self.frame_size)
 
+    def start_encoder(self, queue_size=64, policy='duplicate'):
+        """
+        Encodes frames passed to add_frame on a background thread from now on.
+        See FrameEncoder for the queue_size and policy parameters.
+        :raises ValueError: If the writer has not been initialized.
+        """
+        if self.video_writer is None:
+            raise ValueError("VideoWriterState is not properly initialized.")
+        if self.encoder is None:
+            self.encoder = FrameEncoder(self, queue_size, policy)
+        return self.encoder
+
     def release(self):
-        """Releases the video writer."""
-        if self.video_writer is not None:
-            self.video_writer.release()
-            self.video_writer = None
+        """Writes any frames still queued for the encoder, then releases the video writer."""
+        try:
+            if self.encoder is not None:
+                self.encoder.close()
+        finally:
+            self.encoder = None
+            if self.video_writer is not None:
+                self.video_writer.release()
+                self.video_writer = None
 
-def add_frame(frame, video_writer_state):
+def add_frame(frame, video_writer_state, num_repeats=None):
+    """
+    Adds a frame to the video.
+    :param frame: The frame as a BGR array.
+    :param video_writer_state: The initialized VideoWriterState.
+    :param num_repeats: Number of times to write the frame. By default the frame is held for the
+                        wall-clock time since the previous frame, for real-time playback. Frames
+                        with an explicit count are never dropped by the encoder.
+    """
     if video_writer_state.video_writer is None:
         raise ValueError("VideoWriterState is not properly initialized.")
     
-    frame_np = np.array(frame)  # Convert frame to a NumPy array
+    frame_np = np.asarray(frame)  # Convert frame to a NumPy array
     
     if video_writer_state.frame_size is None:
         video_writer_state.frame_size = (frame_np.shape[1], frame_np.shape[0])  # Set frame size on first frame
 
-    frame_resized = cv2.resize(frame_np, video_writer_state.frame_size)  # Resize the frame
-    
     current_time = time.time()
     
-    # Handle holding frames for real-time playback
-    if video_writer_state.last_frame_time is not None:
+    # Handle holding frames for real-time playback, unless the caller decides how long the frame is shown
+    block = None
+    if num_repeats is not None:
+        block = True  # Offline rendering has no real-time deadline, so never drop its frames
+    elif video_writer_state.last_frame_time is not None:
         elapsed_time = current_time - video_writer_state.last_frame_time
         target_time_per_frame = 1 / video_writer_state.fps
         
@@ -77,12 +211,23 @@ def add_frame(frame, video_writer_state):
     else:
         num_repeats = 1  # First frame, no repeats needed
     
+    video_writer_state.last_frame_time = current_time  # Update last frame time
+
+    if video_writer_state.encoder is not None:
+        # Resizing and writing happen on the encoder thread
+        video_writer_state.encoder.submit(frame_np, num_repeats, block)
+        return
+
+    # Frames from a figure sized with fit_figure_to_frame already match the video
+    if (frame_np.shape[1], frame_np.shape[0]) != tuple(video_writer_state.frame_size):
+        frame_resized = cv2.resize(frame_np, video_writer_state.frame_size)  # Resize the frame
+    else:
+        frame_resized = frame_np
+
     # Write the frame multiple times to hold for real-time
     for _ in range(num_repeats):
         video_writer_state.video_writer.write(frame_resized)
-    
-    video_writer_state.last_frame_time = current_time  # Update last frame time
 
 def release_video_writer(video_state: VideoWriterState):
-    """Releases the video writer state."""
+    """Releases the video writer state, waiting for any queued frames to be encoded."""
     video_state.release()